@@ -1,53 +1,81 @@
-import os
+import itertools
+import operator
 import re
-from langgraph.checkpoint.sqlite import SqliteSaver
-from langgraph.graph import StateGraph, END
+import time
+from langgraph.graph import StateGraph, START, END
 from langchain_core.messages import SystemMessage, HumanMessage
+from langchain_core.runnables import RunnableConfig
 from langchain_core.pydantic_v1 import BaseModel
-from tavily import TavilyClient
-from typing import TypedDict, List
-from langchain_google_genai import ChatGoogleGenerativeAI
+from typing import Annotated, TypedDict, List, Optional
 from dotenv import load_dotenv
-import sys
-import io
+from factory import compiled_graph, search_client
+from routing import FAST_ROUTES, WRITER_MODEL, ModelRoute, ModelRouter
+from research import search_queries
+from corpus import select_content
+from blobs import load_text, load_texts, merge_content_refs, store_text, store_texts
+from streaming import DRAFT_NODES, NODE_LABELS, revision_streams, stream_plan
+from structured import PLAN_FORMAT, QUERY_FORMAT, extract_json, try_parse_plan
+from nutrition import nutrition_report
+from shopping_list import SHOPPING_LIST_NOTE, parse_people, with_shopping_list
+from fanout import PLAN_DAYS, fan_out_days, plan_length, generate_days, merge_day_drafts, repeated_meals
+from revisions import revise_flagged_sections
+from convergence import SEVERITY_INSTRUCTIONS, ConvergencePolicy, parse_severity, response_tokens
+from run_trace import RunTrace, record
+from horizon import earlier_weeks_messages, requested_days, stream_long_plan, window_thread_id, windows
+from checkpoint import get_checkpointer, load_plan, new_thread_id, thread_config
+from metrics import observed_run, serve_metrics
+from limits import NODE_RETRY
 import streamlit as st
 
 load_dotenv()
-
-memory = SqliteSaver.from_conn_string(":memory:")
+# Exposes /metrics when METRICS_PORT is set
+serve_metrics()
 
 class AgentState(TypedDict):
     task: str
     plan: str
     draft: str
     critique: str
-    content: List[str]
+    # Hashes of research snippets in the blob store; both research nodes can
+    # write in the same step and merge_content_refs combines their snippets
+    content: Annotated[List[str], merge_content_refs]
     revision_number: int
     max_revisions: int
-
-model = ChatGoogleGenerativeAI(model="gemini-1.5-pro", temperature=0.4)
-
-PLAN_PROMPT = """You are an expert meal outline planner tasked with creating a 7-day meal plan outline.
+    critique_severity: Optional[int]
+    tokens_used: Annotated[int, operator.add]
+    started_at: float
+    stop_reason: Optional[str]
+    meal_plan: Optional[dict]
+    # (days, blob hash) per branch of the fanned-out first draft
+    day_drafts: Annotated[list, operator.add]
+    # Days to write when shorter than a week, e.g. the last window of a long plan
+    plan_days: Optional[int]
+    # In a long plan, what the weeks before this one contained (see horizon.py)
+    earlier_weeks: Optional[str]
+
+# Graph nodes whose model responses are reused for identical prompts
+LLM_CACHE_NODES = {
+    "meal_planner", "research_meal_plan", "generate", "generate_day", "merge_days", "reflect_plan", "research_critique"
+}
+
+# Write the first draft as one branch per day in parallel, then merge them
+FAN_OUT_DAYS = True
+
+# The plan and the drafts come from the large model; queries and critique from a faster one
+model = ModelRouter(ModelRoute(WRITER_MODEL, 0.4), FAST_ROUTES, cache_nodes=LLM_CACHE_NODES)
+
+# Stops the revision loop early once the draft settles or the critique has nothing important left
+convergence = ConvergencePolicy()
+
+PLAN_PROMPT = """You are an expert meal outline planner tasked with creating a {days}-day meal plan outline.
 Give the outline of the meal plan along with any relevant notes, calories,
 recipes based on user preferences, shopping list based on ingredients, available ingredients or instructions for the recipe."""
 
-WRITER_PROMPT = """You are an excellent meal planner generator tasked with writing an excellent 7-day meal plan with schedules.
-Write a detailed and concise final 7-day meal plan Following this template:
-Day 1:
-  Breakfast -
-  Lunch -
-  Dinner -
-Day 2:
-  Breakfast -
-  Lunch -
-  Dinner -
-...
-Day 7:
-  Breakfast -
-  Lunch -
-  Dinner -
+WRITER_PROMPT = """You are an excellent meal planner generator tasked with writing an excellent {days}-day meal plan with schedules.
+Write a detailed and concise final {days}-day meal plan Following this template:
+{day_template}
 Add optional snacks in between these times.
-Please include the shopping list, calories, protein, and ingredients for the meal plan.
+Please include the calories, protein, and ingredients for the meal plan.
 Generate the best meal plan possible for the user's request based on the provided template,
 Provide every detail concisely.
 If the user provides critique, respond with a revised version of your previous attempts.
@@ -55,6 +83,17 @@ Use all the information below as needed:
 ------
 {content}"""
 
+DAY_TEMPLATE = """Day {number}:
+  Breakfast -
+  Lunch -
+  Dinner -"""
+
+def day_template(days):
+    # Days 1, 2, ... and the last one, so the model knows where to stop
+    if days <= 3:
+        return "\n".join(DAY_TEMPLATE.format(number=n) for n in range(1, days + 1))
+    return "\n".join([DAY_TEMPLATE.format(number=1), DAY_TEMPLATE.format(number=2), "...", DAY_TEMPLATE.format(number=days)])
+
 REFLECTION_PROMPT = """You are a critic reviewing a meal plan. 
 Generate critique and recommendations for the user's meal plan. 
 Select the best recipes considering nutritional requirements and dietary restrictions. 
@@ -69,145 +108,264 @@ be used when making any requested revisions. Generate a list of search queries t
 class Queries(BaseModel):
     queries: List[str]
 
-tavily = TavilyClient(api_key=os.environ["TAVILY_API_KEY"])
+tavily = search_client()
 
 def ensure_7_day_plan(task):
     if "7-day meal plan" not in task:
         task += "\nPlease create a 7-day meal plan."
     return task
 
-def plan_node(state: AgentState):
+def plan_node(state: AgentState, config: RunnableConfig):
     messages = [
-        SystemMessage(content=PLAN_PROMPT),
+        SystemMessage(content=PLAN_PROMPT.format(days=plan_length(state))),
         HumanMessage(content=state['task'])
-    ]
-    response = model.invoke(messages)
-    plan_node_result = print("Plan agent Response: ", response.content)
-    plan_node_result
-    return {"plan": response.content}
+    ] + earlier_weeks_messages(state)
+    response = model.invoke(messages, config)
+    record(config, "Plan agent Response", response.content)
+    return {
+        "plan": response.content,
+        "started_at": state.get("started_at") or time.time(),
+        "tokens_used": response_tokens(response)
+    }
 
 def parse_queries(response_content):
-    # Extract queries from the response content using regex
-    pattern = r'\*\*"(.*?)"\*\*'
-    queries = re.findall(pattern, response_content)
-    return queries
+    # The research prompts ask for JSON matching Queries; older **"query"** replies still parse
+    try:
+        return Queries.parse_raw(extract_json(response_content)).queries
+    except ValueError:
+        pattern = r'\*\*"(.*?)"\*\*'
+        return re.findall(pattern, response_content)
 
-def research_meal_plan_node(state: AgentState):
+def research_meal_plan_node(state: AgentState, config: RunnableConfig):
     messages = [
-        SystemMessage(content=RESEARCH_PLAN_PROMPT),
+        SystemMessage(content=RESEARCH_PLAN_PROMPT + QUERY_FORMAT),
         HumanMessage(content=state['task'])
     ]
-    response = model.invoke(messages)
+    response = model.invoke(messages, config)
     queries = parse_queries(response.content)
-    content = state['content'] or []
-    for q in queries:
-        search_response = tavily.search(query=q, max_results=2)
-        for r in search_response['results']:
-            content.append(r['content'])
-    research_meal_plan_node = print("Research Meal Plan Response:", response.content)  # Debug print
-    research_meal_plan_node
-    return {"content": content}
-
-def generation_node(state: AgentState):
-    content = "\n\n".join(state['content'] or [])
-    user_message = HumanMessage(
-        content=f"{state['task']}\n\nHere is my meal plan:\n\n{state['plan']}")
-    messages = [
-        SystemMessage(
-            content=WRITER_PROMPT.format(content=content)
-        ),
-        user_message
-    ]
-    response = model.invoke(messages)
-    generation_node = print("Generation Response: ", response.content)
-    generation_node
+    content = store_texts(search_queries(tavily, queries))
+    record(config, "Research Meal Plan Response", response.content)
+    return {"content": content, "tokens_used": response_tokens(response)}
+
+def generation_node(state: AgentState, config: RunnableConfig):
+    content = "\n\n".join(select_content(load_texts(state['content']), state['task'], state.get('critique')))
+    # When the critique names specific days or sections, rewrite only those
+    response, draft = revise_flagged_sections(model, state, content, config)
+    if response is None:
+        user_message = HumanMessage(
+            content=f"{state['task']}\n\nHere is my meal plan:\n\n{state['plan']}")
+        messages = [
+            SystemMessage(
+                content=WRITER_PROMPT.format(
+                    days=plan_length(state), day_template=day_template(plan_length(state)), content=content
+                ) + PLAN_FORMAT + SHOPPING_LIST_NOTE
+            ),
+            user_message
+        ] + earlier_weeks_messages(state)
+        response = model.invoke(messages, config)
+        draft = response.content
+    record(config, "Generation Response", draft)
+    return finish_draft(state, draft, response_tokens(response))
+
+def outline_ready_node(state: AgentState):
+    # Join point: fan_out_days needs both the outline and the initial research
+    return {}
+
+def day_generation_node(branch: dict, config: RunnableConfig):
+    # Runs once per group of days sent by fan_out_days, concurrently with the others
+    content = "\n\n".join(select_content(load_texts(branch['content']), branch['task']))
+    response = generate_days(model, branch, content, PLAN_FORMAT, config)
+    return {
+        "day_drafts": [(branch['days'], store_text(response.content))],
+        "tokens_used": response_tokens(response)
+    }
+
+def merge_days_node(state: AgentState, config: RunnableConfig):
+    draft = merge_day_drafts([(days, load_text(ref)) for days, ref in state['day_drafts']])
+    tokens = 0
+    # Days were written independently, so replace any dish served twice in the week
+    variety_critique = repeated_meals(draft)
+    if variety_critique:
+        content = "\n\n".join(select_content(load_texts(state['content']), state['task']))
+        response, revised = revise_flagged_sections(
+            model, {**state, "draft": draft, "critique": variety_critique}, content, config)
+        if response is not None:
+            draft, tokens = revised, response_tokens(response)
+    record(config, "Generation Response", draft)
+    return finish_draft(state, draft, tokens)
+
+def finish_draft(state, draft, tokens):
+    parsed = try_parse_plan(draft)
+    meal_plan = parsed.to_dict() if parsed else None
+    # The shopping list is computed from the ingredients instead of written by the model
+    draft = with_shopping_list(draft, meal_plan, parse_people(state['task']))
     return {
-        "draft": response.content,
-        "revision_number": state.get("revision_number", 1) + 1
+        "draft": draft,
+        "meal_plan": meal_plan,
+        "revision_number": state.get("revision_number", 1) + 1,
+        "tokens_used": tokens,
+        "stop_reason": convergence.after_draft(state, draft, state.get("tokens_used", 0) + tokens)
     }
 
-def reflection_node(state: AgentState):
+def reflection_node(state: AgentState, config: RunnableConfig):
     messages = [
-        SystemMessage(content=REFLECTION_PROMPT),
+        SystemMessage(content=REFLECTION_PROMPT + SEVERITY_INSTRUCTIONS),
         HumanMessage(content=state['draft'])
     ]
-    response = model.invoke(messages)
-    reflection_node = print("Reflection Response:", response.content)
-    reflection_node
-    return {"critique": response.content}
-
-def ensure_7_day_plan(task):
-    if "7-day meal plan" not in task:
-        task += "\nPlease create a 7-day meal plan."
-    return task
-
+    # Give the critic computed calories and protein instead of having it estimate them
+    report = nutrition_report(state.get('meal_plan'), state['task'])
+    if report:
+        messages.append(HumanMessage(content=report))
+    response = model.invoke(messages, config)
+    record(config, "Reflection Response", response.content)
+    severity = parse_severity(response.content)
+    tokens_used = state.get("tokens_used", 0) + response_tokens(response)
+    return {
+        "critique": response.content,
+        "critique_severity": severity,
+        "tokens_used": response_tokens(response),
+        "stop_reason": convergence.after_critique(state, severity, tokens_used)
+    }
 
-def research_critique_node(state: AgentState):
+def research_critique_node(state: AgentState, config: RunnableConfig):
     messages = [
-        SystemMessage(content=RESEARCH_CRITIQUE_PROMPT),
+        SystemMessage(content=RESEARCH_CRITIQUE_PROMPT + QUERY_FORMAT),
         HumanMessage(content=state['critique'])
     ]
-    response = model.invoke(messages)
-    research_critique_node = print("Research Critique Response:", response.content)  # Debug print
-    research_critique_node
+    response = model.invoke(messages, config)
+    record(config, "Research Critique Response", response.content)
     queries = parse_queries(response.content)
-    content = state['content'] or []
-    for q in queries:
-        search_response = tavily.search(query=q, max_results=2)
-        for r in search_response['results']:
-            content.append(r['content'])
-    return {"content": content}
+    content = store_texts(search_queries(tavily, queries))
+    return {"content": content, "tokens_used": response_tokens(response)}
 
 def should_continue(state):
-    if state["revision_number"] > state["max_revisions"]:
+    if state.get("stop_reason") or state["revision_number"] > state["max_revisions"]:
         return END
     return "reflect_plan"
 
-builder = StateGraph(AgentState)
-
-builder.add_node("meal_planner", plan_node)
-builder.add_node("generate", generation_node)
-builder.add_node("reflect_plan", reflection_node)
-builder.add_node("research_meal_plan", research_meal_plan_node)
-builder.add_node("research_critique", research_critique_node)
-
-builder.set_entry_point("meal_planner")
-
-builder.add_conditional_edges(
-    "generate", 
-    should_continue, 
-    {END: END, "reflect_plan": "reflect_plan"}
-)
+def should_revise(state):
+    if state.get("stop_reason"):
+        return END
+    return "research_critique"
+
+def build_graph():
+    builder = StateGraph(AgentState)
+
+    # Nodes that call Gemini or Tavily run again if a call still fails after its own retries
+    builder.add_node("meal_planner", plan_node, retry=NODE_RETRY)
+    builder.add_node("generate", generation_node, retry=NODE_RETRY)
+    builder.add_node("reflect_plan", reflection_node, retry=NODE_RETRY)
+    builder.add_node("research_meal_plan", research_meal_plan_node, retry=NODE_RETRY)
+    builder.add_node("research_critique", research_critique_node, retry=NODE_RETRY)
+    if FAN_OUT_DAYS:
+        builder.add_node("outline_ready", outline_ready_node)
+        builder.add_node("generate_day", day_generation_node, retry=NODE_RETRY)
+        builder.add_node("merge_days", merge_days_node, retry=NODE_RETRY)
+
+    # The outline and the initial research only need the task, so they run side by side
+    builder.add_edge(START, "meal_planner")
+    builder.add_edge(START, "research_meal_plan")
+
+    builder.add_conditional_edges(
+        "generate", 
+        should_continue, 
+        {END: END, "reflect_plan": "reflect_plan"}
+    )
+
+    if FAN_OUT_DAYS:
+        builder.add_edge(["meal_planner", "research_meal_plan"], "outline_ready")
+        builder.add_conditional_edges("outline_ready", fan_out_days, ["generate_day"])
+        builder.add_edge("generate_day", "merge_days")
+        builder.add_conditional_edges(
+            "merge_days",
+            should_continue,
+            {END: END, "reflect_plan": "reflect_plan"}
+        )
+    else:
+        builder.add_edge(["meal_planner", "research_meal_plan"], "generate")
+    builder.add_conditional_edges(
+        "reflect_plan",
+        should_revise,
+        {END: END, "research_critique": "research_critique"}
+    )
+    builder.add_edge("research_critique", "generate")
 
-builder.add_edge("meal_planner", "research_meal_plan")
-builder.add_edge("research_meal_plan", "generate")
-builder.add_edge("reflect_plan", "research_critique")
-builder.add_edge("research_critique", "generate")
+    return builder.compile(checkpointer=get_checkpointer())
 
-graph = builder.compile(checkpointer=memory)
+# Compiled on first use and shared by every session in the process
+graph = compiled_graph("Streamlit_App", build_graph)
 
-def start_agents(task):
-    # Save the current stdout
-    old_stdout = sys.stdout
-    sys.stdout = io.StringIO()  # Redirect stdout to a buffer
-    
-    try:
-        thread = {"configurable": {"thread_id": "1"}}
+def start_agents(task, thread_id, trace=None):
+    with observed_run(thread_id):
         responses = list(graph.stream({
             'task': task,
             "max_revisions": 2,
             "revision_number": 1
-        }, thread))
-    finally:
-        # Restore the original stdout
-        sys.stdout = old_stdout
-    
+        }, thread_config(thread_id, trace=trace)))
+
     if responses:
-        draft = responses[-1].get('generate', {}).get('draft', 'No draft found')
+        # The run can also end at reflect_plan, so look for the last draft written
+        draft = next(
+            (r[node]['draft'] for r in reversed(responses) for node in DRAFT_NODES if node in r),
+            'No draft found'
+        )
         return draft
     else:
         "No responses received"
 
+def stream_agents(task, thread_id, trace=None):
+    # A task of None resumes the run saved under thread_id from its last checkpoint
+    inputs = None if task is None else {
+        'task': task,
+        "max_revisions": 2,
+        "revision_number": 1
+    }
+    with observed_run(thread_id):
+        yield from stream_plan(graph, inputs, thread_config(thread_id, trace=trace))
+
+def render_stream(events):
+    st.subheader("Generated Meal Plan:")
+    status = st.status("Generating your meal plan...")
+    draft_area = st.empty()
+    final = {}
+
+    def on_node(node, update):
+        status.write(NODE_LABELS.get(node, node))
+        if node in DRAFT_NODES:
+            final["draft"] = update.get("draft")
+
+    # Each revision streams into the same placeholder, replacing the previous
+    # draft once its first token arrives. Whether or not anything streamed
+    # (the merged first week and section-only revisions stream no tokens),
+    # the full draft from the node's update is drawn once it finishes, so it
+    # stays on screen while the critique and research run
+    for tokens in revision_streams(events, on_node):
+        first = next(tokens, None)
+        if first is not None:
+            with draft_area.container():
+                st.write_stream(itertools.chain([first], tokens))
+        if final.get("draft"):
+            draft_area.markdown(final["draft"])
+    if not final.get("draft"):
+        draft_area.markdown("No draft found")
+    status.update(label="Meal plan ready", state="complete")
+
+def render_long_plan(task, total_days, thread_id, trace=None):
+    # Each week is shown as soon as it is written; later weeks only see a summary of it
+    st.subheader(f"Generated {total_days}-Day Meal Plan:")
+    status = st.status("Generating your meal plan one week at a time...")
+    for week in stream_long_plan(graph, task, total_days, thread_id, trace=trace):
+        status.write(f"Wrote week {week['week']} of {week['weeks']}")
+        st.markdown(f"#### Week {week['week']}: days {week['first_day']} to {week['last_day']}")
+        st.markdown(week["draft"] or "No draft found")
+    status.update(label="Meal plan ready", state="complete")
+
+def render_trace(trace):
+    with st.expander("Agent responses"):
+        for event in trace.events:
+            st.markdown(f"**{event['label']}** ({event['elapsed']:.1f}s)")
+            st.text(event["content"])
+
 # Streamlit page configuration
 st.set_page_config(page_title="Meal Planner", page_icon="🍽️")
 st.title("AI-Powered Meal Planner 🍽️")
@@ -218,15 +376,56 @@ ROLE_ASSISTANT = "assistant"
 
 # Text area for meal plan input
 task = st.text_area("Enter your Meal Plan")
+stream_output = st.toggle("Show the plan as it is written", value=True)
+show_trace = st.toggle("Show agent responses", value=False)
+
+# The last plan of this session, or one linked through ?plan=<thread id>
+saved_thread_id = st.session_state.get("thread_id") or st.query_params.get("plan")
 
 # Button to trigger meal plan generation
 if st.button("Generate Meal Plan"):
     if task:
-        task = ensure_7_day_plan(task)  # Ensure it requests a 7-day plan
+        total_days = requested_days(task)
+        if total_days <= PLAN_DAYS:
+            task = ensure_7_day_plan(task)  # Ensure it requests a 7-day plan
+        thread_id = new_thread_id()
+        st.session_state["thread_id"] = thread_id
+        st.session_state["horizon"] = {"thread_id": thread_id, "task": task, "days": total_days}
+        st.query_params["plan"] = thread_id
+        # Each run keeps its own trace, so concurrent sessions never see each other's output
+        trace = RunTrace() if show_trace else None
+        try:
+            if total_days > PLAN_DAYS:
+                render_long_plan(task, total_days, thread_id, trace)
+            elif stream_output:
+                render_stream(stream_agents(task, thread_id, trace))
+            else:
+                with st.spinner("Generating your meal plan..."):
+                    draft = start_agents(task, thread_id, trace)
+                st.subheader("Generated Meal Plan:")
+                st.markdown(draft)
+            if trace:
+                render_trace(trace)
+        except Exception as e:
+            st.error(f"Error: {e}")
+elif saved_thread_id:
+    # Re-render from the checkpoint instead of running the graph again
+    values, finished = load_plan(graph, saved_thread_id)
+    horizon = st.session_state.get("horizon")
+    if not values and horizon and horizon["thread_id"] == saved_thread_id:
+        # A long plan: finished weeks are read back from their own checkpoints
+        last_week = window_thread_id(saved_thread_id, len(windows(horizon["days"])))
+        _, long_finished = load_plan(graph, last_week)
+        if long_finished or st.button("Resume unfinished meal plan"):
+            try:
+                render_long_plan(horizon["task"], horizon["days"], saved_thread_id)
+            except Exception as e:
+                st.error(f"Error: {e}")
+    elif values and finished:
+        st.subheader("Generated Meal Plan:")
+        st.markdown(values.get("draft", "No draft found"))
+    elif values and st.button("Resume unfinished meal plan"):
         try:
-            with st.spinner("Generating your meal plan..."):
-                draft = start_agents(task)
-            st.subheader("Generated Meal Plan:")
-            st.markdown(draft)
+            render_stream(stream_agents(None, saved_thread_id))
         except Exception as e:
-            st.error(f"Error: {e}")
\ No newline at end of file
+            st.error(f"Error: {e}")
@@ -1,31 +1,57 @@
-import os
+import operator
 import re
-from langgraph.checkpoint.sqlite import SqliteSaver
-from langgraph.graph import StateGraph, END
+import time
+from langgraph.graph import StateGraph, START, END
 from langchain_core.messages import SystemMessage, HumanMessage
+from langchain_core.runnables import RunnableConfig
 from langchain_core.pydantic_v1 import BaseModel
-from tavily import TavilyClient
-from typing import TypedDict, List
-from langchain_google_genai import ChatGoogleGenerativeAI
+from typing import Annotated, TypedDict, List, Optional
 from dotenv import load_dotenv
+from factory import compiled_graph, search_client
+from routing import FAST_ROUTES, WRITER_MODEL, ModelRoute, ModelRouter
+from research import search_queries
+from corpus import select_content
+from blobs import load_texts, merge_content_refs, store_texts
+from structured import PLAN_FORMAT, QUERY_FORMAT, extract_json, try_parse_plan
+from nutrition import nutrition_report
+from shopping_list import SHOPPING_LIST_NOTE, parse_people, with_shopping_list
+from revisions import revise_flagged_sections
+from convergence import SEVERITY_INSTRUCTIONS, ConvergencePolicy, parse_severity, response_tokens
+from checkpoint import get_checkpointer, new_thread_id, thread_config
+from metrics import observed_run, serve_metrics
+from limits import NODE_RETRY
+from calendar_export import MEAL_TIMES, plan_to_ics
 import streamlit as st
-from datetime import datetime, timedelta
+from datetime import date, timedelta
 
 load_dotenv()
-
-memory = SqliteSaver.from_conn_string(":memory:")
+# Exposes /metrics when METRICS_PORT is set
+serve_metrics()
 
 class AgentState(TypedDict):
     task: str
     plan: str
     draft: str
     critique: str
-    content: List[str]
+    # Hashes of research snippets in the blob store; both research nodes can
+    # write in the same step and merge_content_refs combines their snippets
+    content: Annotated[List[str], merge_content_refs]
     revision_number: int
     max_revisions: int
-    ics_file: str
+    critique_severity: Optional[int]
+    tokens_used: Annotated[int, operator.add]
+    started_at: float
+    stop_reason: Optional[str]
+    meal_plan: Optional[dict]
+
+# Graph nodes whose model responses are reused for identical prompts
+LLM_CACHE_NODES = {"meal_planner", "research_meal_plan", "generate", "reflect_plan", "research_critique"}
+
+# The plan and the drafts come from the large model; queries and critique from a faster one
+model = ModelRouter(ModelRoute(WRITER_MODEL, 0.6), FAST_ROUTES, cache_nodes=LLM_CACHE_NODES)
 
-model = ChatGoogleGenerativeAI(model="gemini-1.5-pro", temperature=0.6)
+# Stops the revision loop early once the draft settles or the critique has nothing important left
+convergence = ConvergencePolicy()
 
 PLAN_PROMPT = """You are an expert meal planner tasked with writing a meal plan. 
 Please create a comprehensive meal plan based on the user's request. 
@@ -37,7 +63,7 @@ Please include the following for each day:
 -Breakfast, 
 -Lunch, 
 -Dinner. Also include snacks if applicable.
-Generate a detailed shopping list for all ingredients needed for the meal plan. If the user provides feedback, 
+List every ingredient needed for each meal. If the user provides feedback, 
 revise the plan accordingly using the information below but still follow the outline:
 ------
 {content}"""
@@ -55,124 +81,153 @@ Generate a list of search queries to gather relevant information. Generate a max
 class Queries(BaseModel):
     queries: List[str]
 
-tavily = TavilyClient(api_key=os.environ["TAVILY_API_KEY"])
+tavily = search_client()
 
-def plan_node(state: AgentState):
+def plan_node(state: AgentState, config: RunnableConfig):
     messages = [
         SystemMessage(content=PLAN_PROMPT),
         HumanMessage(content=state['task'])
     ]
-    response = model.invoke(messages)
-    return {"plan": response.content}
+    response = model.invoke(messages, config)
+    return {
+        "plan": response.content,
+        "started_at": state.get("started_at") or time.time(),
+        "tokens_used": response_tokens(response)
+    }
 
 def parse_queries(response_content):
-    pattern = r'\*\*"(.*?)"\*\*'
-    queries = re.findall(pattern, response_content)
-    return queries
-
-def research_meal_plan_node(state: AgentState):
+    # The research prompts ask for JSON matching Queries; older **"query"** replies still parse
+    try:
+        return Queries.parse_raw(extract_json(response_content)).queries
+    except ValueError:
+        pattern = r'\*\*"(.*?)"\*\*'
+        return re.findall(pattern, response_content)
+
+def research_meal_plan_node(state: AgentState, config: RunnableConfig):
     messages = [
-        SystemMessage(content=RESEARCH_PLAN_PROMPT),
+        SystemMessage(content=RESEARCH_PLAN_PROMPT + QUERY_FORMAT),
         HumanMessage(content=state['task'])
     ]
-    response = model.invoke(messages)
+    response = model.invoke(messages, config)
     queries = parse_queries(response.content)
-    content = state['content'] or []
-    for q in queries:
-        search_response = tavily.search(query=q, max_results=2)
-        for r in search_response['results']:
-            content.append(r['content'])
-    return {"content": content}
-
-def generation_node(state: AgentState):
-    content = "\n\n".join(state['content'] or [])
-    user_message = HumanMessage(
-        content=f"{state['task']}\n\nHere is my meal plan:\n\n{state['plan']}")
-    messages = [
-        SystemMessage(
-            content=WRITER_PROMPT.format(content=content)
-        ),
-        user_message
-    ]
-    response = model.invoke(messages)
-    
-    state['draft'] = response.content  # Set 'draft' in the state
-
+    content = store_texts(search_queries(tavily, queries))
+    return {"content": content, "tokens_used": response_tokens(response)}
+
+def generation_node(state: AgentState, config: RunnableConfig):
+    content = "\n\n".join(select_content(load_texts(state['content']), state['task'], state.get('critique')))
+    # When the critique names specific days or sections, rewrite only those
+    response, draft = revise_flagged_sections(model, state, content, config)
+    if response is None:
+        user_message = HumanMessage(
+            content=f"{state['task']}\n\nHere is my meal plan:\n\n{state['plan']}")
+        messages = [
+            SystemMessage(
+                content=WRITER_PROMPT.format(content=content) + PLAN_FORMAT + SHOPPING_LIST_NOTE
+            ),
+            user_message
+        ]
+        response = model.invoke(messages, config)
+        draft = response.content
+    tokens_used = state.get("tokens_used", 0) + response_tokens(response)
+    parsed = try_parse_plan(draft)
+    meal_plan = parsed.to_dict() if parsed else None
+    # The shopping list is computed from the ingredients instead of written by the model
+    draft = with_shopping_list(draft, meal_plan, parse_people(state['task']))
     return {
-        "draft": response.content,
-        "revision_number": state.get("revision_number", 1) + 1
+        "draft": draft,
+        "meal_plan": meal_plan,
+        "revision_number": state.get("revision_number", 1) + 1,
+        "tokens_used": response_tokens(response),
+        "stop_reason": convergence.after_draft(state, draft, tokens_used)
     }
 
-def reflection_node(state: AgentState):
+def reflection_node(state: AgentState, config: RunnableConfig):
     if 'draft' not in state or not state['draft']:
         raise ValueError("No draft available for reflection.")
     
     messages = [
-        SystemMessage(content=REFLECTION_PROMPT),
+        SystemMessage(content=REFLECTION_PROMPT + SEVERITY_INSTRUCTIONS),
         HumanMessage(content=state['draft'])
     ]
-    response = model.invoke(messages)
-    return {"critique": response.content}
+    # Give the critic computed calories and protein instead of having it estimate them
+    report = nutrition_report(state.get('meal_plan'), state['task'])
+    if report:
+        messages.append(HumanMessage(content=report))
+    response = model.invoke(messages, config)
+    severity = parse_severity(response.content)
+    tokens_used = state.get("tokens_used", 0) + response_tokens(response)
+    return {
+        "critique": response.content,
+        "critique_severity": severity,
+        "tokens_used": response_tokens(response),
+        "stop_reason": convergence.after_critique(state, severity, tokens_used)
+    }
 
-def research_critique_node(state: AgentState):
+def research_critique_node(state: AgentState, config: RunnableConfig):
     messages = [
-        SystemMessage(content=RESEARCH_CRITIQUE_PROMPT),
+        SystemMessage(content=RESEARCH_CRITIQUE_PROMPT + QUERY_FORMAT),
         HumanMessage(content=state['critique'])
     ]
-    response = model.invoke(messages)
+    response = model.invoke(messages, config)
     queries = parse_queries(response.content)
-    content = state['content'] or []
-    for q in queries:
-        search_response = tavily.search(query=q, max_results=2)
-        for r in search_response['results']:
-            content.append(r['content'])
-    return {"content": content}
+    content = store_texts(search_queries(tavily, queries))
+    return {"content": content, "tokens_used": response_tokens(response)}
 
 
 def should_continue(state):
-    if state["revision_number"] > state["max_revisions"]:
+    if state.get("stop_reason") or state["revision_number"] > state["max_revisions"]:
         return END
     return "reflect_plan"
 
-builder = StateGraph(AgentState)
+def should_revise(state):
+    if state.get("stop_reason"):
+        return END
+    return "research_critique"
+
+def build_graph():
+    builder = StateGraph(AgentState)
 
-builder.add_node("meal_planner", plan_node)
-builder.add_node("generate", generation_node)
-builder.add_node("reflect_plan", reflection_node)
-builder.add_node("research_meal_plan", research_meal_plan_node)
-builder.add_node("research_critique", research_critique_node)
+    # Nodes that call Gemini or Tavily run again if a call still fails after its own retries
+    builder.add_node("meal_planner", plan_node, retry=NODE_RETRY)
+    builder.add_node("generate", generation_node, retry=NODE_RETRY)
+    builder.add_node("reflect_plan", reflection_node, retry=NODE_RETRY)
+    builder.add_node("research_meal_plan", research_meal_plan_node, retry=NODE_RETRY)
+    builder.add_node("research_critique", research_critique_node, retry=NODE_RETRY)
 
-builder.set_entry_point("meal_planner")
+    # The outline and the initial research only need the task, so they run side by side
+    builder.add_edge(START, "meal_planner")
+    builder.add_edge(START, "research_meal_plan")
 
-builder.add_conditional_edges(
-    "generate", 
-    should_continue, 
-    {END: END, "reflect_plan": "reflect_plan"}
-)
+    builder.add_conditional_edges(
+        "generate", 
+        should_continue, 
+        {END: END, "reflect_plan": "reflect_plan"}
+    )
 
-builder.add_edge("meal_planner", "research_meal_plan")
-builder.add_edge("research_meal_plan", "generate")
-builder.add_edge("reflect_plan", "research_critique")
-builder.add_edge("research_critique", "generate")
-builder.add_edge("generate", "generate_ics")
-builder.add_edge("generate_ics", END)
+    builder.add_edge(["meal_planner", "research_meal_plan"], "generate")
+    builder.add_conditional_edges(
+        "reflect_plan",
+        should_revise,
+        {END: END, "research_critique": "research_critique"}
+    )
+    builder.add_edge("research_critique", "generate")
 
-graph = builder.compile(checkpointer=memory)
+    return builder.compile(checkpointer=get_checkpointer())
+
+# Compiled on first use and shared by every session in the process
+graph = compiled_graph("app", build_graph)
 
 def run_agent(task):
-    thread = {"configurable": {"thread_id": "1"}}
-    last_generate_state = {}
-    for state in graph.stream({
-        'task': task,
-        "max_revisions": 2,
-        "revision_number": 1
-    }, thread):
-        print(state, "\n\n")
-        if state.get('draft'):
-            last_generate_state['draft'] = state['draft']
-        if state.get('ics_file'):
-            last_generate_state['ics_file'] = state['ics_file']
-    return last_generate_state
+    thread_id = new_thread_id()
+    final_state = {}
+    with observed_run(thread_id):
+        for final_state in graph.stream({
+            'task': task,
+            "max_revisions": 2,
+            "revision_number": 1
+        }, thread_config(thread_id), stream_mode="values"):
+            pass
+    return final_state
 
 # Streamlit frontend
 ROLE_USER = "user"
@@ -182,11 +237,20 @@ st.set_page_config(page_title="Meal Planner", page_icon="🍽️")
 st.title("AI-Powered Meal Planner 🍽️ 1")
 st.markdown("Create personalized meal plans with AI. Please provide your dietary preferences and restrictions, and our AI will generate a comprehensive meal plan for you.")
 
+# Drafts kept per browser session; older ones are dropped so long-lived sessions stay small
+MAX_SESSION_DRAFTS = 3
+
 if "messages" not in st.session_state:
-    st.session_state["messages"] = {}
+    st.session_state["messages"] = []
+
+def remember(role, content):
+    messages = st.session_state.messages
+    messages.append((role, content))
+    # Each draft is kept with the task that asked for it
+    del messages[:-2 * MAX_SESSION_DRAFTS]
 
 def display_messages():
-    for name, content in st.session_state.messages.items():
+    for name, content in st.session_state.messages:
         st.chat_message(name).write(content)
 
 task = st.text_area("Enter your Meal plan")
@@ -196,13 +260,32 @@ if st.button("Generate Meal Plan"):
             with st.spinner("Generating your meal plan..."):
                 response = run_agent(task)
             if response:
-                st.session_state.messages[ROLE_ASSISTANT] = response['draft']
-                st.session_state["ics_file"] = response.get("ics_file", "")
+                remember(ROLE_USER, task)
+                remember(ROLE_ASSISTANT, response['draft'])
+                st.session_state["meal_plan"] = response.get("meal_plan")
             display_messages()
             st.markdown(response['draft'])
-            if "ics_file" in st.session_state and st.session_state["ics_file"]:
-                st.markdown(f"[Download ICS file](./meal_plan.ics)")
         except Exception as e:
             st.error(f"Error: {e}")
 
 display_messages()
+
+def calendar_export(meal_plan):
+    # Built in memory on each rerun from the plan kept in the session, so
+    # concurrent users never share or leave behind a file on disk
+    st.subheader("Add to your calendar")
+    start_date = st.date_input("First day of the plan", value=date.today() + timedelta(days=1))
+    with st.expander("Meal times"):
+        meal_times = {
+            slot: st.time_input(slot.capitalize(), value=default, key=f"meal_time_{slot}")
+            for slot, default in MEAL_TIMES.items()
+        }
+    st.download_button(
+        "Download calendar (.ics)",
+        data=plan_to_ics(meal_plan, start_date, meal_times),
+        file_name="meal_plan.ics",
+        mime="text/calendar",
+    )
+
+if st.session_state.get("meal_plan"):
+    calendar_export(st.session_state["meal_plan"])
@@ -0,0 +1,108 @@
+import hashlib
+import json
+import os
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from checkpoint import load_plan, thread_config
+from metrics import observed_run
+
+BATCH_WORKERS = 4
+DEFAULT_MAX_REVISIONS = 2
+
+
+def read_tasks(path, default_max_revisions=DEFAULT_MAX_REVISIONS):
+    # One JSON object per line: {"task": ..., "max_revisions": ..., "id": ...}.
+    # Only "task" is required; the id defaults to the line number.
+    tasks = []
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            row = json.loads(line)
+            tasks.append({
+                "id": str(row.get("id", line_number)),
+                "task": row["task"],
+                "max_revisions": int(row.get("max_revisions", default_max_revisions)),
+            })
+    return tasks
+
+
+def completed_ids(output_path):
+    if not os.path.exists(output_path):
+        return set()
+    done = set()
+    with open(output_path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                row = json.loads(line)
+                if row.get("status") == "ok":
+                    done.add(row["id"])
+    return done
+
+
+def batch_thread_id(tasks_path, task_id):
+    # Stable per task, so a rerun picks the task up from its last checkpoint.
+    digest = hashlib.sha1(os.path.abspath(tasks_path).encode("utf-8")).hexdigest()[:12]
+    return f"batch-{digest}-{task_id}"
+
+
+def run_task(graph, tasks_path, task):
+    thread_id = batch_thread_id(tasks_path, task["id"])
+    started = time.perf_counter()
+    values, finished = load_plan(graph, thread_id)
+    if not finished:
+        inputs = None if values else {
+            "task": task["task"],
+            "max_revisions": task["max_revisions"],
+            "revision_number": 1,
+        }
+        with observed_run(thread_id):
+            for _ in graph.stream(inputs, thread_config(thread_id)):
+                pass
+        values, _ = load_plan(graph, thread_id)
+    return {
+        "id": task["id"],
+        "status": "ok",
+        "task": task["task"],
+        "draft": values.get("draft"),
+        "latency": round(time.perf_counter() - started, 3),
+    }
+
+
+def run_batch(graph, tasks_path, output_path, workers=BATCH_WORKERS, log=print):
+    done = completed_ids(output_path)
+    tasks = [t for t in read_tasks(tasks_path) if t["id"] not in done]
+    log(f"{len(done)} tasks already done, {len(tasks)} to run with {workers} workers")
+
+    started = time.perf_counter()
+    latencies, failures = [], 0
+    with ThreadPoolExecutor(max_workers=workers) as executor, open(output_path, "a", encoding="utf-8") as out:
+        futures = {executor.submit(run_task, graph, tasks_path, task): task for task in tasks}
+        for future in as_completed(futures):
+            task = futures[future]
+            try:
+                result = future.result()
+                latencies.append(result["latency"])
+                log(f"[{task['id']}] done in {result['latency']:.1f}s")
+            except Exception as e:
+                failures += 1
+                result = {"id": task["id"], "status": "error", "task": task["task"], "error": str(e)}
+                log(f"[{task['id']}] failed: {e}")
+            # Flushed per task so an interrupted batch keeps everything finished so far
+            out.write(json.dumps(result) + "\n")
+            out.flush()
+
+    elapsed = time.perf_counter() - started
+    summary = {
+        "completed": len(latencies),
+        "failed": failures,
+        "elapsed": round(elapsed, 3),
+        "plans_per_minute": round(len(latencies) / elapsed * 60, 2) if elapsed else 0.0,
+        "latency_mean": round(statistics.mean(latencies), 3) if latencies else None,
+        "latency_p50": round(statistics.median(latencies), 3) if latencies else None,
+        "latency_max": round(max(latencies), 3) if latencies else None,
+    }
+    log(json.dumps(summary))
+    return summary
@@ -0,0 +1,195 @@
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(ROOT))
+sys.path.insert(0, ROOT)
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from fakes import FakeLatency, install_fakes
+
+TASKS = {
+    "small": "Write me a 7 day meal plan for bulking.",
+    "medium": "I am bulking with a weight of 50 kg and 6 feet height, please write me a 7 day meal plan "
+              "for my bulking with about 3000 kcal and 160 g protein per day.",
+    "large": "I am bulking with a weight of 50 kg and 6 feet height and I train five times a week, mostly "
+             "in the evening. Please write me a 7 day meal plan with about 3000 kcal and 160 g protein per "
+             "day. I am lactose intolerant, I don't eat pork, I prefer quick breakfasts under 10 minutes, "
+             "I can cook in bulk on Sundays and Wednesdays, my budget is about 80 dollars a week, I like "
+             "spicy food, Mediterranean and Mexican dishes, and I would like a shake after every workout. "
+             "Please include snacks between meals and keep dinners high in protein.",
+}
+
+
+class NodeTimer(BaseCallbackHandler):
+    # Wall time spent inside each graph node, from LangChain's chain callbacks.
+    # A node's own run is the one named after its langgraph_node; nested runs
+    # (the model call inside it) are ignored.
+
+    def __init__(self):
+        self.started = {}
+        self.seconds = defaultdict(float)
+        self.calls = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def on_chain_start(self, serialized, inputs, *, run_id, metadata=None, **kwargs):
+        node = (metadata or {}).get("langgraph_node")
+        if node is not None and kwargs.get("name") == node:
+            with self._lock:
+                self.started[run_id] = (node, time.perf_counter())
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        with self._lock:
+            started = self.started.pop(run_id, None)
+            if started is not None:
+                node, at = started
+                self.seconds[node] += time.perf_counter() - at
+                self.calls[node] += 1
+
+    on_chain_error = on_chain_end
+
+
+def run_once(graph, task, max_revisions, latencies, trace_memory=False):
+    from checkpoint import new_thread_id, thread_config
+
+    model, search = install_fakes(*latencies)
+    graph.get_graph()  # build outside the timed region
+    timer = NodeTimer()
+    config = thread_config(new_thread_id())
+    config["callbacks"] = config.get("callbacks", []) + [timer]
+    inputs = {"task": task, "max_revisions": max_revisions, "revision_number": 1}
+
+    if trace_memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    for _ in graph.stream(inputs, config):
+        pass
+    latency = time.perf_counter() - started
+    peak = None
+    if trace_memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    values = graph.get_state(config).values
+    return {
+        "latency": latency,
+        "peak_memory": peak,
+        "nodes": dict(timer.seconds),
+        "node_calls": dict(timer.calls),
+        "stop_reason": values.get("stop_reason"),
+        "revisions": values.get("revision_number", 1) - 1,
+        **model.stats(),
+        **search.stats(),
+    }
+
+
+def run_case(graph, name, task, max_revisions, repeats, latencies):
+    runs = [run_once(graph, task, max_revisions, latencies) for _ in range(repeats)]
+    # tracemalloc slows Python down, so peak memory comes from one extra run
+    memory = run_once(graph, task, max_revisions, latencies, trace_memory=True)
+    latencies = [r["latency"] for r in runs]
+    nodes = defaultdict(list)
+    for r in runs:
+        for node, seconds in r["nodes"].items():
+            nodes[node].append(seconds)
+    last = runs[-1]
+    return {
+        "case": f"{name}/max_revisions={max_revisions}",
+        "task_size": name,
+        "max_revisions": max_revisions,
+        "runs": repeats,
+        "latency_mean": statistics.mean(latencies),
+        "latency_median": statistics.median(latencies),
+        "latency_max": max(latencies),
+        "node_seconds": {node: statistics.mean(values) for node, values in sorted(nodes.items())},
+        "node_calls": last["node_calls"],
+        "llm_calls": last["llm_calls"],
+        "llm_calls_by_prompt": last["llm_calls_by_prompt"],
+        "llm_calls_by_model": last["llm_calls_by_model"],
+        "prompt_tokens": last["prompt_tokens"],
+        "output_tokens": last["output_tokens"],
+        "search_calls": last["search_calls"],
+        "peak_memory_mb": memory["peak_memory"] / 2 ** 20,
+        "revisions": last["revisions"],
+        "stop_reason": last["stop_reason"],
+    }
+
+
+def print_report(results):
+    print(f"{'case':<30} {'mean s':>8} {'max s':>8} {'llm':>5} {'prompt tok':>11} {'output tok':>11} "
+          f"{'search':>7} {'peak MB':>8}  stop")
+    for r in results:
+        print(f"{r['case']:<30} {r['latency_mean']:8.2f} {r['latency_max']:8.2f} {r['llm_calls']:5d} "
+              f"{r['prompt_tokens']:11d} {r['output_tokens']:11d} {r['search_calls']:7d} "
+              f"{r['peak_memory_mb']:8.1f}  {r['stop_reason']}")
+    print("\nmean seconds per node (summed over a run)")
+    for r in results:
+        nodes = ", ".join(f"{node} {seconds:.2f}" for node, seconds in r["node_seconds"].items())
+        print(f"{r['case']:<30} {nodes}")
+
+
+def regressions(results, baseline_path, tolerance):
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {r["case"]: r for r in json.load(f)["results"]}
+    problems = []
+    for r in results:
+        before = baseline.get(r["case"])
+        if before is None:
+            continue
+        for metric in ("latency_mean", "prompt_tokens", "output_tokens", "llm_calls", "search_calls", "peak_memory_mb"):
+            if r[metric] > before[metric] * (1 + tolerance):
+                problems.append(f"{r['case']}: {metric} {before[metric]:.2f} -> {r[metric]:.2f}")
+    return problems
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="End-to-end plan latency with offline model and search backends.")
+    parser.add_argument("--max-revisions", type=int, nargs="+", default=[1, 2, 3])
+    parser.add_argument("--tasks", nargs="+", choices=sorted(TASKS), default=sorted(TASKS))
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--model-latency", type=float, default=0.05, help="seconds per model call")
+    parser.add_argument("--token-latency", type=float, default=0.0002, help="extra seconds per output token")
+    parser.add_argument("--fast-model-latency", type=float, default=0.02, help="seconds per call to the fast model")
+    parser.add_argument("--fast-token-latency", type=float, default=0.00005, help="extra seconds per fast model output token")
+    parser.add_argument("--search-latency", type=float, default=0.02, help="seconds per search query")
+    parser.add_argument("--jitter", type=float, default=0.0, help="random +/- fraction applied to every delay")
+    parser.add_argument("--json", metavar="PATH", help="also write the results as JSON")
+    parser.add_argument("--baseline", metavar="PATH", help="JSON from an earlier run; exit 1 if any metric regressed")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed increase over the baseline (default 20%%)")
+    args = parser.parse_args()
+
+    # Keep benchmark checkpoints out of the app's database; set before main imports checkpoint
+    os.environ["CHECKPOINT_PATH"] = os.path.join(tempfile.mkdtemp(prefix="meal-bench-"), "checkpoints.db")
+    os.chdir(os.path.dirname(ROOT))
+    import main
+    from routing import FAST_MODEL
+
+    latencies = (
+        FakeLatency(args.model_latency, args.token_latency, args.jitter),
+        FakeLatency(args.search_latency, jitter=args.jitter),
+        {FAST_MODEL: FakeLatency(args.fast_model_latency, args.fast_token_latency, args.jitter)},
+    )
+    results = [
+        run_case(main.graph, name, TASKS[name], max_revisions, args.repeats, latencies)
+        for name in args.tasks
+        for max_revisions in args.max_revisions
+    ]
+    print_report(results)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"created": time.time(), "settings": vars(args), "results": results}, f, indent=2)
+    if args.baseline:
+        problems = regressions(results, args.baseline, args.tolerance)
+        for problem in problems:
+            print("REGRESSION", problem)
+        sys.exit(1 if problems else 0)
@@ -0,0 +1,177 @@
+import json
+import os
+import random
+import re
+import threading
+import time
+import zlib
+from collections import Counter
+
+from langchain_core.messages import AIMessage
+
+from corpus import estimate_tokens
+from factory import use_backend
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+_DAYS = re.compile(r"Write only Days? (\d+)(?: to (\d+))?")
+_REVISED_DAY = re.compile(r"^\W*day\s+(\d+)\b", re.IGNORECASE | re.MULTILINE)
+_TOTAL_DAYS = re.compile(r"(\d+)[- ]day\b", re.IGNORECASE)
+
+
+def load_fixture(name):
+    with open(os.path.join(FIXTURES_DIR, name), encoding="utf-8") as f:
+        return json.load(f)
+
+
+class FakeLatency:
+    # Seconds slept per call: `base` plus `per_token` for every output token,
+    # stretched by up to +/- `jitter` (a fraction) with a seeded generator so
+    # runs are repeatable.
+
+    def __init__(self, base=0.0, per_token=0.0, jitter=0.0, seed=0):
+        self.base = base
+        self.per_token = per_token
+        self.jitter = jitter
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def wait(self, tokens=0):
+        delay = self.base + self.per_token * tokens
+        if self.jitter:
+            with self._lock:
+                delay *= 1 + self._random.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+
+class FakeChatModel:
+    # Offline stand-in for ChatGoogleGenerativeAI. Works out which prompt it
+    # was given from the system message and replays the matching recorded
+    # response from fixtures/gemini.json, so the whole graph runs without
+    # network or keys. Successive drafts and revisions rotate through the
+    # recorded days, so the revision loop sees real changes.
+
+    def __init__(self, fixtures=None, latency=None, model_name="fake"):
+        self.fixtures = fixtures or load_fixture("gemini.json")
+        self.latency = latency or FakeLatency()
+        self.model_name = model_name
+        self._lock = threading.Lock()
+        self.calls = Counter()
+        self.models = Counter()
+        self.input_tokens = 0
+        self.output_tokens = 0
+
+    def invoke(self, messages, config=None, latency=None, model_name=None):
+        system = messages[0].content if messages else ""
+        prompt = "\n".join(m.content for m in messages)
+        role = self.role(system)
+        with self._lock:
+            turn = self.calls[role]
+            self.calls[role] += 1
+            self.models[model_name or self.model_name] += 1
+        text = self.respond(role, turn, system, prompt)
+        input_tokens, output_tokens = estimate_tokens(prompt), estimate_tokens(text)
+        with self._lock:
+            self.input_tokens += input_tokens
+            self.output_tokens += output_tokens
+        (latency or self.latency).wait(output_tokens)
+        return AIMessage(content=text, usage_metadata={
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "total_tokens": input_tokens + output_tokens,
+        })
+
+    @staticmethod
+    def role(system):
+        if "critic reviewing" in system:
+            return "critique"
+        if "researcher" in system:
+            return "queries"
+        if "outline planner" in system:
+            return "plan"
+        if "revising parts" in system:
+            return "revision"
+        if _DAYS.search(system):
+            return "days"
+        return "draft"
+
+    def day(self, number, offset=0):
+        days = self.fixtures["days"]
+        return days[(number - 1 + offset) % len(days)].format(day=number)
+
+    def respond(self, role, turn, system, prompt):
+        if role in ("plan", "queries", "critique"):
+            recorded = self.fixtures[{"plan": "plan", "queries": "queries", "critique": "critiques"}[role]]
+            return recorded[min(turn, len(recorded) - 1)]
+        if role == "days":
+            first, last = _DAYS.search(system).groups()
+            numbers = range(int(first), int(last or first) + 1)
+            return "\n\n".join(self.day(n) for n in numbers)
+        if role == "revision":
+            sections = prompt.split("Sections to revise:", 1)[-1]
+            numbers = sorted({int(n) for n in _REVISED_DAY.findall(sections)})
+            return "\n\n".join(self.day(n, offset=turn + 1) for n in numbers)
+        total = _TOTAL_DAYS.search(prompt)
+        total = int(total.group(1)) if total else 7
+        return "\n\n".join(self.day(n, offset=turn) for n in range(1, total + 1))
+
+    def stats(self):
+        with self._lock:
+            return {
+                "llm_calls": sum(self.calls.values()),
+                "llm_calls_by_prompt": dict(self.calls),
+                "llm_calls_by_model": dict(self.models),
+                "prompt_tokens": self.input_tokens,
+                "output_tokens": self.output_tokens,
+            }
+
+
+class FakeModelRoute:
+    # What each chat_model() gets: the shared fake, answering with the
+    # latency configured for that model name.
+
+    def __init__(self, fake, model_name, latency=None):
+        self.fake = fake
+        self.model_name = model_name
+        self.latency = latency
+
+    def invoke(self, messages, config=None, **kwargs):
+        return self.fake.invoke(messages, config, latency=self.latency, model_name=self.model_name)
+
+
+class FakeSearchClient:
+    # Offline stand-in for TavilyClient.search: each query gets a stable
+    # selection of the recorded results in fixtures/tavily.json.
+
+    def __init__(self, fixtures=None, latency=None):
+        self.results = (fixtures or load_fixture("tavily.json"))["results"]
+        self.latency = latency or FakeLatency()
+        self._lock = threading.Lock()
+        self.calls = 0
+
+    def search(self, query, max_results=5, **kwargs):
+        with self._lock:
+            self.calls += 1
+        self.latency.wait()
+        start = zlib.crc32(query.encode("utf-8")) % len(self.results)
+        picked = [self.results[(start + i) % len(self.results)] for i in range(min(max_results, len(self.results)))]
+        return {"query": query, "results": picked}
+
+    def stats(self):
+        with self._lock:
+            return {"search_calls": self.calls}
+
+
+def install_fakes(model_latency=None, search_latency=None, model_latencies=None):
+    # Routes every chat_model() and search_client() in the process to one
+    # shared fake of each, and returns them for reading their counters.
+    # `model_latencies` maps model names to a FakeLatency of their own.
+    model = FakeChatModel(latency=model_latency)
+    search = FakeSearchClient(latency=search_latency)
+    model_latencies = model_latencies or {}
+    use_backend("chat_model", lambda model_name, temperature: FakeModelRoute(
+        model, model_name, model_latencies.get(model_name)
+    ))
+    use_backend("search_client", lambda: search)
+    return model, search
@@ -0,0 +1,68 @@
+import argparse
+import os
+import runpy
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def cold_start(script, runs):
+    # Fresh interpreter each time: imports plus one execution of the script.
+    code = f"import runpy; runpy.run_path({script!r})"
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code], cwd=ROOT, check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        timings.append(time.perf_counter() - started)
+    return timings
+
+
+def reruns(script, runs):
+    # What Streamlit does on every widget interaction: execute the page
+    # script again in a process that already imported everything.
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        namespace = runpy.run_path(script)
+        timings.append(time.perf_counter() - started)
+    return timings, namespace
+
+
+def first_use(namespace):
+    # The first attribute access builds the model, search client and graph;
+    # later accesses, in this or any later rerun, reuse them.
+    timings = []
+    for _ in range(2):
+        started = time.perf_counter()
+        namespace["graph"].get_graph()
+        timings.append(time.perf_counter() - started)
+    return timings
+
+
+def summary(label, timings):
+    print(f"{label:<28} mean {statistics.mean(timings) * 1000:9.1f} ms   "
+          f"min {min(timings) * 1000:9.1f} ms   runs {len(timings)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure cold start and rerun cost of a page script.")
+    parser.add_argument("script", nargs="?", default="Streamlit_App.py")
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    # Building the clients only needs the keys to be present, not valid
+    os.environ.setdefault("GOOGLE_API_KEY", "benchmark")
+    os.environ.setdefault("TAVILY_API_KEY", "benchmark")
+    os.chdir(ROOT)
+    sys.path.insert(0, ROOT)
+
+    summary("cold start", cold_start(args.script, args.runs))
+    rerun_timings, namespace = reruns(args.script, args.runs)
+    summary("page rerun", rerun_timings)
+    build, reuse = first_use(namespace)
+    summary("first resource build", [build])
+    summary("shared resource reuse", [reuse])
@@ -0,0 +1,130 @@
+import hashlib
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from checkpoint import CHECKPOINT_PATH
+from corpus import MAX_CORPUS_SNIPPETS, merge_content
+from metrics import metrics
+
+BLOB_MEMORY_ENTRIES = 4096
+
+_REF = re.compile(r"[0-9a-f]{64}")
+
+
+def blob_ref(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class BlobStore:
+    # Content-addressed text storage next to the checkpoints. The graph state
+    # keeps only the sha256 of research snippets and day drafts, so each
+    # checkpoint stores a list of short hashes instead of another copy of
+    # every snippet, and identical text is stored once however many runs
+    # and steps refer to it.
+
+    def __init__(self, path=CHECKPOINT_PATH, memory_entries=BLOB_MEMORY_ENTRIES):
+        self.memory_entries = memory_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS blobs (ref TEXT PRIMARY KEY, text TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def _remember(self, ref, text):
+        self._memory[ref] = text
+        self._memory.move_to_end(ref)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def put_many(self, texts):
+        refs = [blob_ref(t) for t in texts]
+        now = time.time()
+        with self._lock:
+            # Always written, even when remembered: the retention sweep may have
+            # deleted the row since. An existing row only gets a fresh created_at,
+            # so the sweep's grace period also covers text stored again.
+            rows = [(r, t, now) for r, t in zip(refs, texts)]
+            if rows:
+                self._conn.executemany(
+                    "INSERT INTO blobs (ref, text, created_at) VALUES (?, ?, ?) "
+                    "ON CONFLICT(ref) DO UPDATE SET created_at = excluded.created_at",
+                    rows,
+                )
+                self._conn.commit()
+            for ref, text in zip(refs, texts):
+                self._remember(ref, text)
+        return refs
+
+    def get_many(self, refs):
+        # Texts in the order of `refs`. Entries that are not hashes are taken
+        # as the text itself (state checkpointed before the store existed);
+        # hashes with no stored text are skipped and counted in blob_missing_total.
+        with self._lock:
+            missing = [r for r in set(refs) if r not in self._memory and _REF.fullmatch(r)]
+            for start in range(0, len(missing), 500):
+                chunk = missing[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT ref, text FROM blobs WHERE ref IN ({','.join('?' * len(chunk))})", chunk
+                ).fetchall()
+                for ref, text in rows:
+                    self._remember(ref, text)
+            texts, lost = [], 0
+            for ref in refs:
+                if ref in self._memory:
+                    texts.append(self._memory[ref])
+                elif not _REF.fullmatch(ref):
+                    texts.append(ref)
+                else:
+                    lost += 1
+        if lost:
+            metrics.inc("blob_missing_total", lost)
+        return texts
+
+    def put(self, text):
+        return self.put_many([text])[0]
+
+    def get(self, ref):
+        texts = self.get_many([ref])
+        return texts[0] if texts else None
+
+
+_default_store = None
+_default_store_lock = threading.Lock()
+
+
+def default_store():
+    global _default_store
+    with _default_store_lock:
+        if _default_store is None:
+            _default_store = BlobStore()
+        return _default_store
+
+
+def store_texts(texts):
+    return default_store().put_many(list(texts))
+
+
+def load_texts(refs):
+    return default_store().get_many(list(refs or []))
+
+
+def store_text(text):
+    return default_store().put(text)
+
+
+def load_text(ref):
+    return default_store().get(ref) or ""
+
+
+def merge_content_refs(content, new_refs):
+    # merge_content over the texts behind the hashes, for use as the state
+    # reducer of `content`. LangGraph calls reducers with exactly two
+    # arguments, so the cap comes from MAX_CORPUS_SNIPPETS.
+    texts = load_texts(list(content or []) + list(new_refs))
+    return store_texts(merge_content([], texts, MAX_CORPUS_SNIPPETS))
@@ -0,0 +1,146 @@
+import hashlib
+import io
+import json
+import zipfile
+from datetime import date, datetime, time, timedelta, timezone
+
+from structured import MealPlan, format_amount, try_parse_plan
+
+MEAL_TIMES = {
+    "breakfast": time(8, 0),
+    "lunch": time(12, 30),
+    "snack": time(16, 0),
+    "dinner": time(19, 0),
+}
+MEAL_DURATION = timedelta(minutes=30)
+# A second snack on the same day starts this much after the first
+SNACK_SPACING = timedelta(hours=2)
+PRODID = "-//AI Meal Planner//Meal Plan Export//EN"
+
+
+def ics_escape(text):
+    # Chained replace is several times faster than str.translate for this
+    return (text or "").replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,").replace("\n", "\\n")
+
+
+def fold(line):
+    # RFC 5545: content lines are at most 75 octets, continued with CRLF + space.
+    data = line.encode("utf-8")
+    if len(data) <= 75:
+        return data + b"\r\n"
+    parts, start, limit = [], 0, 75
+    while start < len(data):
+        end = min(start + limit, len(data))
+        # Never split a multi-byte character
+        while end < len(data) and (data[end] & 0xC0) == 0x80:
+            end -= 1
+        parts.append(data[start:end])
+        start, limit = end, 74
+    return b"\r\n ".join(parts) + b"\r\n"
+
+
+def _stamp(moment):
+    return f"{moment.year:04d}{moment.month:02d}{moment.day:02d}T{moment.hour:02d}{moment.minute:02d}{moment.second:02d}"
+
+
+def meal_description(meal):
+    lines = []
+    if meal.calories is not None:
+        lines.append(f"{format_amount(meal.calories)} kcal")
+    if meal.protein is not None:
+        lines.append(f"{format_amount(meal.protein)} g protein")
+    if meal.ingredients:
+        lines.append("Ingredients: " + ", ".join(
+            " ".join(p for p in (
+                format_amount(i.quantity) if i.quantity is not None else "", i.unit, i.name
+            ) if p)
+            for i in meal.ingredients
+        ))
+    return "\n".join(lines)
+
+
+def iter_events(plan, start_date, meal_times=None, uid_prefix="meal-plan"):
+    # Content lines of one VEVENT per meal. Day N of the plan falls on
+    # start_date + N - 1; times are floating (the attendee's local time).
+    if isinstance(plan, dict):
+        plan = MealPlan.from_dict(plan)
+    meal_times = {**MEAL_TIMES, **(meal_times or {})}
+    created = _stamp(datetime.now(timezone.utc)) + "Z"
+    for day in plan.days:
+        day_date = start_date + timedelta(days=day.number - 1)
+        seen = {}
+        for meal in day.meals:
+            repeat = seen.get(meal.slot, 0)
+            seen[meal.slot] = repeat + 1
+            starts = datetime.combine(day_date, meal_times.get(meal.slot, MEAL_TIMES["snack"])) + repeat * SNACK_SPACING
+            yield "BEGIN:VEVENT"
+            yield f"UID:{uid_prefix}-day{day.number}-{meal.slot}{repeat or ''}@meal-planner"
+            yield f"DTSTAMP:{created}"
+            yield f"DTSTART:{_stamp(starts)}"
+            yield f"DTEND:{_stamp(starts + MEAL_DURATION)}"
+            yield f"SUMMARY:{ics_escape(f'{meal.slot.capitalize()}: {meal.title}')}"
+            description = meal_description(meal)
+            if description:
+                yield f"DESCRIPTION:{ics_escape(description)}"
+            yield "END:VEVENT"
+
+
+def write_ics(out, plan, start_date, meal_times=None, name="Meal Plan", uid_prefix=None):
+    # Streams the calendar into any binary file-like object line by line, so
+    # the whole document never sits in memory as one string.
+    if uid_prefix is None:
+        uid_prefix = hashlib.sha1(json.dumps(
+            plan if isinstance(plan, dict) else plan.to_dict(), sort_keys=True
+        ).encode("utf-8")).hexdigest()[:12]
+    out.write(b"BEGIN:VCALENDAR\r\nVERSION:2.0\r\n")
+    out.write(fold(f"PRODID:{PRODID}"))
+    out.write(fold(f"X-WR-CALNAME:{ics_escape(name)}"))
+    for line in iter_events(plan, start_date, meal_times, uid_prefix):
+        out.write(fold(line))
+    out.write(b"END:VCALENDAR\r\n")
+
+
+def plan_to_ics(plan, start_date=None, meal_times=None, name="Meal Plan"):
+    buffer = io.BytesIO()
+    write_ics(buffer, plan, start_date or date.today() + timedelta(days=1), meal_times, name)
+    return buffer.getvalue()
+
+
+def export_many(plans, out, start_date, meal_times=None):
+    # One .ics per client in a zip written to `out`; `plans` yields
+    # (client id, plan) pairs and is consumed lazily. Returns the number of
+    # calendars written.
+    count = 0
+    with zipfile.ZipFile(out, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for client_id, plan in plans:
+            with archive.open(f"{client_id}.ics", "w") as entry:
+                write_ics(entry, plan, start_date, meal_times, name=f"Meal Plan {client_id}", uid_prefix=str(client_id))
+            count += 1
+    return count
+
+
+def batch_plans(results_path):
+    # (id, parsed plan) for every finished task in a batch results file.
+    with open(results_path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            row = json.loads(line)
+            plan = try_parse_plan(row.get("draft")) if row.get("status") == "ok" else None
+            if plan is not None:
+                yield row["id"], plan
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Export the plans in a batch results file as calendars.")
+    parser.add_argument("results", help="JSONL written by main.py --batch")
+    parser.add_argument("--output", default="calendars.zip")
+    parser.add_argument("--start", type=date.fromisoformat, default=date.today() + timedelta(days=1),
+                        help="date of day 1, YYYY-MM-DD (default: tomorrow)")
+    args = parser.parse_args()
+
+    with open(args.output, "wb") as f:
+        count = export_many(batch_plans(args.results), f, args.start)
+    print(f"Wrote {count} calendars to {args.output}")
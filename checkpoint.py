@@ -0,0 +1,46 @@
+import os
+import sqlite3
+import threading
+import uuid
+
+from langgraph.checkpoint.sqlite import SqliteSaver
+
+from metrics import node_metrics
+from retention import start_retention
+
+CHECKPOINT_PATH = os.environ.get("CHECKPOINT_PATH", "checkpoints.db")
+
+_savers = {}
+_savers_lock = threading.Lock()
+
+
+def get_checkpointer(path=CHECKPOINT_PATH):
+    # One WAL-mode connection per database file, shared by every session in
+    # the process. SqliteSaver serializes access to it with its own lock. Old
+    # checkpoints are pruned in the background, see retention.py.
+    with _savers_lock:
+        if path not in _savers:
+            conn = sqlite3.connect(path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            _savers[path] = SqliteSaver(conn)
+            start_retention(_savers[path])
+        return _savers[path]
+
+
+def new_thread_id():
+    return uuid.uuid4().hex
+
+
+def thread_config(thread_id, **configurable):
+    # node_metrics times every node of every run started with this config
+    return {"configurable": {"thread_id": thread_id, **configurable}, "callbacks": [node_metrics]}
+
+
+def load_plan(graph, thread_id):
+    # Returns the saved state of a run and whether it reached the end, or
+    # (None, False) if nothing was checkpointed for this thread.
+    snapshot = graph.get_state(thread_config(thread_id))
+    if not snapshot.values:
+        return None, False
+    return snapshot.values, not snapshot.next
@@ -0,0 +1,55 @@
+import difflib
+import re
+import time
+
+SEVERITY_INSTRUCTIONS = """
+Finish with a final line "Severity: N", where N is 0 if nothing important needs to change and 10 if the plan must be rewritten."""
+
+_SEVERITY = re.compile(r"severity\s*[:=]\s*(\d+)", re.IGNORECASE)
+
+
+def parse_severity(critique):
+    matches = _SEVERITY.findall(critique or "")
+    return min(int(matches[-1]), 10) if matches else None
+
+
+def draft_change(previous, draft):
+    # Share of the draft that changed, measured over words: 0.0 is identical.
+    return 1.0 - difflib.SequenceMatcher(None, (previous or "").split(), (draft or "").split()).ratio()
+
+
+def response_tokens(response):
+    usage = getattr(response, "usage_metadata", None) or {}
+    return usage.get("total_tokens", 0)
+
+
+class ConvergencePolicy:
+    # Decides when the generate/reflect loop can stop before max_revisions.
+    # Each check returns a stop reason for AgentState['stop_reason'], or None
+    # to keep revising. Budgets of None are not enforced.
+
+    def __init__(self, min_draft_change=0.05, max_severity=2, time_budget=None, token_budget=None):
+        self.min_draft_change = min_draft_change
+        self.max_severity = max_severity
+        self.time_budget = time_budget
+        self.token_budget = token_budget
+
+    def after_draft(self, state, draft, tokens_used):
+        if state.get("revision_number", 1) + 1 > state["max_revisions"]:
+            return "max_revisions"
+        if state.get("draft") and draft_change(state["draft"], draft) < self.min_draft_change:
+            return "draft_converged"
+        return self.budget_spent(state, tokens_used)
+
+    def after_critique(self, state, severity, tokens_used):
+        if severity is not None and severity <= self.max_severity:
+            return "critique_minor"
+        return self.budget_spent(state, tokens_used)
+
+    def budget_spent(self, state, tokens_used):
+        if self.token_budget is not None and tokens_used >= self.token_budget:
+            return "token_budget"
+        started_at = state.get("started_at")
+        if self.time_budget is not None and started_at and time.time() - started_at >= self.time_budget:
+            return "time_budget"
+        return None
@@ -0,0 +1,91 @@
+import hashlib
+import math
+import re
+from collections import Counter
+
+CONTENT_TOKEN_BUDGET = 3000  # approximate tokens of research passed to the writer
+MAX_CORPUS_SNIPPETS = 40
+NEAR_DUPLICATE_THRESHOLD = 0.8
+SHINGLE_SIZE = 3
+
+_WORD = re.compile(r"\w+")
+
+
+def tokenize(text):
+    return _WORD.findall(text.lower())
+
+
+def estimate_tokens(text):
+    # Roughly four characters per token for English text; close enough for a budget.
+    return max(1, len(text) // 4)
+
+
+def shingles(tokens, size=SHINGLE_SIZE):
+    if len(tokens) < size:
+        return {tuple(tokens)}
+    return {tuple(tokens[i:i + size]) for i in range(len(tokens) - size + 1)}
+
+
+def dedupe_snippets(snippets, threshold=NEAR_DUPLICATE_THRESHOLD):
+    # Drops exact repeats (ignoring case and whitespace) and snippets whose word
+    # shingles overlap an earlier snippet by at least `threshold` (Jaccard).
+    seen_hashes = set()
+    kept, kept_shingles = [], []
+    for snippet in snippets:
+        tokens = tokenize(snippet)
+        digest = hashlib.sha1(" ".join(tokens).encode("utf-8")).hexdigest()
+        if digest in seen_hashes:
+            continue
+        snippet_shingles = shingles(tokens)
+        if any(len(snippet_shingles & other) / len(snippet_shingles | other) >= threshold
+               for other in kept_shingles):
+            continue
+        seen_hashes.add(digest)
+        kept.append(snippet)
+        kept_shingles.append(snippet_shingles)
+    return kept
+
+
+def merge_content(content, new_snippets, max_snippets=MAX_CORPUS_SNIPPETS):
+    # Newest research wins when the corpus is full, since it answers the latest critique.
+    merged = dedupe_snippets(list(content or []) + list(new_snippets))
+    return merged[-max_snippets:]
+
+
+def bm25_scores(query, documents, k1=1.5, b=0.75):
+    doc_tokens = [tokenize(d) for d in documents]
+    if not doc_tokens:
+        return []
+    avg_len = sum(len(t) for t in doc_tokens) / len(doc_tokens) or 1
+    doc_freq = Counter()
+    for tokens in doc_tokens:
+        doc_freq.update(set(tokens))
+    n = len(doc_tokens)
+    query_terms = set(tokenize(query))
+    scores = []
+    for tokens in doc_tokens:
+        tf = Counter(tokens)
+        score = 0.0
+        for term in query_terms:
+            if term not in tf:
+                continue
+            idf = math.log(1 + (n - doc_freq[term] + 0.5) / (doc_freq[term] + 0.5))
+            score += idf * tf[term] * (k1 + 1) / (tf[term] + k1 * (1 - b + b * len(tokens) / avg_len))
+        scores.append(score)
+    return scores
+
+
+def select_content(content, task, critique="", token_budget=CONTENT_TOKEN_BUDGET):
+    # Rank the research corpus against the task and latest critique and keep
+    # the best snippets that fit in the writer prompt's budget.
+    snippets = dedupe_snippets(content or [])
+    scores = bm25_scores(f"{task}\n{critique or ''}", snippets)
+    ranked = sorted(range(len(snippets)), key=lambda i: scores[i], reverse=True)
+    selected, used = [], 0
+    for i in ranked:
+        cost = estimate_tokens(snippets[i])
+        if used + cost > token_budget:
+            continue
+        selected.append(snippets[i])
+        used += cost
+    return selected
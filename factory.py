@@ -0,0 +1,110 @@
+import os
+import threading
+
+from llm_cache import CachedModel, ResponseCache
+from limits import BackendLimiter, LimitedModel, LimitedSearch
+from metrics import InstrumentedModel, InstrumentedSearch
+from recipe_index import FallbackSearch
+from search_cache import CachedSearchClient
+
+_resources = {}
+_lock = threading.RLock()
+# kind -> function building a stand-in client, see use_backend()
+_backends = {}
+
+
+def shared(key, build):
+    # Builds a resource the first time it is asked for and hands the same
+    # object to every later caller in the process. Streamlit re-executes the
+    # page script on every interaction but keeps imported modules, so this
+    # registry survives reruns the way st.cache_resource does.
+    with _lock:
+        if key not in _resources:
+            _resources[key] = build()
+        return _resources[key]
+
+
+class Lazy:
+    # Stands in for a shared resource at module level and only builds it on
+    # first use, so importing a script needs neither API keys nor network.
+
+    def __init__(self, key, build):
+        self._key = key
+        self._build = build
+
+    def __getattr__(self, name):
+        return getattr(shared(self._key, self._build), name)
+
+
+def use_backend(kind, build):
+    # Replaces the real client of `kind` ("chat_model" or "search_client") with
+    # whatever `build` returns, e.g. the offline fakes in benchmarks/fakes.py.
+    # chat_model builds are called with (model_name, temperature). Stand-ins
+    # skip the response caches and rate limits but are still measured, and
+    # everything built so far is dropped so the next use picks them up.
+    with _lock:
+        _backends[kind] = build
+        _resources.clear()
+
+
+def backend_limiter(backend):
+    # Every model (or search client) of a backend shares its rate limit
+    return shared(("limiter", backend), lambda: BackendLimiter.from_env(backend))
+
+
+def chat_model(model_name, temperature, cache_nodes=None, max_output_tokens=None):
+    def build():
+        if "chat_model" in _backends:
+            return InstrumentedModel(_backends["chat_model"](model_name, temperature), model_name)
+        from langchain_google_genai import ChatGoogleGenerativeAI
+        options = {"max_output_tokens": max_output_tokens} if max_output_tokens else {}
+        # Measured below the cache, so the call metrics only see requests that reach Gemini
+        return CachedModel(
+            InstrumentedModel(LimitedModel(
+                # No client-side retries: the limiter is the only retry layer, and
+                # backs off without holding a concurrency slot
+                ChatGoogleGenerativeAI(model=model_name, temperature=temperature, max_retries=0, **options),
+                backend_limiter("gemini"),
+            ), model_name),
+            ResponseCache(),
+            nodes=cache_nodes,
+            model_name=model_name,
+            temperature=temperature,
+        )
+    nodes_key = frozenset(cache_nodes) if cache_nodes is not None else None
+    return Lazy(("chat_model", model_name, temperature, nodes_key, max_output_tokens), build)
+
+
+def web_search():
+    def build():
+        from tavily import TavilyClient
+        client = LimitedSearch(TavilyClient(api_key=os.environ["TAVILY_API_KEY"]), backend_limiter("tavily"))
+        # Measured below the cache, so the call metrics only see requests that reach Tavily
+        return CachedSearchClient(InstrumentedSearch(client, "tavily"))
+    return Lazy(("web_search",), build)
+
+
+def query_embedder():
+    # Embeds queries for an index built with dense vectors; set
+    # RECIPE_EMBEDDING_MODEL to the model the index was built with.
+    model_name = os.environ.get("RECIPE_EMBEDDING_MODEL")
+    if not model_name:
+        return None
+    from langchain_google_genai import GoogleGenerativeAIEmbeddings
+    embeddings = GoogleGenerativeAIEmbeddings(model=model_name)
+    return lambda texts: backend_limiter("gemini").call(embeddings.embed_documents, texts)
+
+
+def search_client():
+    # The local recipe index (see recipe_index.py), falling back to Tavily for
+    # queries it has no good match for, or for all of them until an index is
+    # built. Tavily is only set up once a query actually needs it.
+    def build():
+        if "search_client" in _backends:
+            return InstrumentedSearch(_backends["search_client"](), "tavily")
+        return FallbackSearch(web_search(), embed=query_embedder())
+    return Lazy(("search_client",), build)
+
+
+def compiled_graph(name, build):
+    return Lazy(("graph", name), build)
@@ -0,0 +1,81 @@
+import re
+
+from langchain_core.messages import HumanMessage, SystemMessage
+from langgraph.constants import Send
+
+from structured import try_parse_plan
+
+PLAN_DAYS = 7
+DAYS_PER_BRANCH = 1
+
+DAY_PROMPT = """You are an excellent meal planner writing part of a {total_days}-day meal plan.
+Write only {days} of the plan, following the user's request and the outline of the whole week.
+Other days are written separately, so do not write any other days, a shopping list or a weekly summary.
+Use all the information below as needed:
+------
+{content}"""
+
+
+def day_groups(total_days=PLAN_DAYS, per_branch=DAYS_PER_BRANCH):
+    days = list(range(1, total_days + 1))
+    return [days[i:i + per_branch] for i in range(0, total_days, per_branch)]
+
+
+def describe_days(days):
+    return f"Day {days[0]}" if len(days) == 1 else f"Days {days[0]} to {days[-1]}"
+
+
+def plan_length(state):
+    # Runs shorter than a week (the last window of a long plan) set plan_days
+    return state.get("plan_days") or PLAN_DAYS
+
+
+def fan_out_days(state, node="generate_day", total_days=None, per_branch=DAYS_PER_BRANCH):
+    # One branch per group of days, all run in the same super-step.
+    total_days = total_days or plan_length(state)
+    return [
+        Send(node, {
+            "days": days,
+            "total_days": total_days,
+            "task": state["task"],
+            "plan": state["plan"],
+            "content": state["content"],
+            "earlier_weeks": state.get("earlier_weeks"),
+        })
+        for days in day_groups(total_days, per_branch)
+    ]
+
+
+def generate_days(model, branch, content, plan_format, config=None):
+    messages = [
+        SystemMessage(content=DAY_PROMPT.format(
+            total_days=branch["total_days"], days=describe_days(branch["days"]), content=content
+        ) + plan_format),
+        HumanMessage(content=f"{branch['task']}\n\nHere is my meal plan outline:\n\n{branch['plan']}"),
+    ]
+    if branch.get("earlier_weeks"):
+        messages.append(HumanMessage(content=branch["earlier_weeks"]))
+    return model.invoke(messages, config)
+
+
+def merge_day_drafts(day_drafts):
+    # Branches finish in any order; the week is assembled by first day number.
+    return "\n\n".join(text.strip() for _, text in sorted(day_drafts, key=lambda d: d[0][0]))
+
+
+def repeated_meals(draft):
+    # A critique naming each meal that repeats a dish from an earlier day, or
+    # None when every dish in the week is different.
+    plan = try_parse_plan(draft)
+    if plan is None:
+        return None
+    seen, repeats = {}, []
+    for day in plan.days:
+        for meal in day.meals:
+            key = re.sub(r"[^a-z]+", " ", meal.title.lower()).strip()
+            if key in seen and seen[key] != day.number:
+                repeats.append(f"Day {day.number} {meal.slot} repeats \"{meal.title}\", which is already served earlier in the week.")
+            seen.setdefault(key, day.number)
+    if not repeats:
+        return None
+    return "\n".join(repeats + ["Replace each repeated meal with a different dish that fits the same targets."])
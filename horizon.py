@@ -0,0 +1,163 @@
+import re
+from collections import deque
+from dataclasses import dataclass, field
+
+import numpy as np
+from langchain_core.messages import HumanMessage
+
+from checkpoint import load_plan, thread_config
+from fanout import PLAN_DAYS
+from metrics import observed_run
+from nutrition import MACROS, plan_macros
+from structured import NUMBER_WORDS, MealPlan
+
+MAX_PLAN_DAYS = 180
+# Dish titles carried into later windows; older ones drop off, so the prompt
+# for week 12 is no longer than the prompt for week 2
+MAX_REMEMBERED_DISHES = 60
+
+_NUMBERS = {"a": 1, **NUMBER_WORDS}
+# Longest first, so "sixteen" is not read as "six"
+_COUNT = "(" + "|".join([r"\d+", *sorted(_NUMBERS, key=len, reverse=True)]) + ")"
+# Only durations that say how long the plan is: "30-day meal plan", "a
+# month-long plan", "plan for the next 6 weeks". Other durations ("bulking
+# for three weeks", "lose 5 kg in 2 months") are not the plan's length.
+_PLAN_LENGTHS = (
+    re.compile(r"\b" + _COUNT + r"[- ]?(days?|weeks?|months?)(?:[- ]long)?\s+(?:[\w-]+\s+){0,2}?plan\b", re.IGNORECASE),
+    re.compile(r"\bplan\s+(?:[\w-]+\s+){0,3}?for\s+(?:the\s+)?(?:next\s+)?" + _COUNT + r"[- ]?(days?|weeks?|months?)\b", re.IGNORECASE),
+)
+_UNIT_DAYS = {"day": 1, "week": 7, "month": 30}
+_DAY_HEADING = re.compile(r"^(\W*day\s+)(\d+)\b", re.IGNORECASE | re.MULTILINE)
+
+WINDOW_TASK = """{task}
+
+This is week {week} of a {total_days}-day meal plan that is written one week at a time.
+Write only {length} days now, numbered Day 1 to Day {length}; they become days {first} to {last} of the full plan."""
+
+
+def requested_days(task, default=PLAN_DAYS):
+    # Length of the plan asked for, from the first phrase that states it.
+    matches = [m for pattern in _PLAN_LENGTHS for m in [pattern.search(task or "")] if m]
+    if not matches:
+        return default
+    count, unit = min(matches, key=lambda m: m.start()).groups()
+    days = int(_NUMBERS.get(count.lower(), count)) * _UNIT_DAYS[unit.lower().rstrip("s")]
+    return min(days, MAX_PLAN_DAYS) if days > 0 else default
+
+
+def windows(total_days, size=PLAN_DAYS):
+    # (first, last) day of each window; the last one may be shorter.
+    return [(first, min(first + size - 1, total_days)) for first in range(1, total_days + 1, size)]
+
+
+def window_thread_id(thread_id, week):
+    return f"{thread_id}-week{week}"
+
+
+def shift_days(draft, offset):
+    # The graph numbers every window from Day 1; renumber to the full plan.
+    if not offset:
+        return draft
+    return _DAY_HEADING.sub(lambda m: f"{m.group(1)}{int(m.group(2)) + offset}", draft)
+
+
+def shift_plan(meal_plan, offset):
+    if not meal_plan or not offset:
+        return meal_plan
+    plan = MealPlan.from_dict(meal_plan)
+    for day in plan.days:
+        day.number += offset
+    return plan.to_dict()
+
+
+def _dish_key(title):
+    return re.sub(r"[^a-z]+", " ", title.lower()).strip()
+
+
+@dataclass(slots=True)
+class HorizonSummary:
+    # What later windows are told about the weeks already written, in place
+    # of their full text: running macro totals and the most recent dishes.
+    days_done: int = 0
+    counted_days: int = 0
+    totals: np.ndarray = field(default_factory=lambda: np.zeros(len(MACROS)))
+    dishes: deque = field(default_factory=lambda: deque(maxlen=MAX_REMEMBERED_DISHES))
+
+    def add_window(self, meal_plan, length):
+        self.days_done += length
+        if not meal_plan:
+            return
+        macros = plan_macros(meal_plan)
+        # Days with ingredients missing from the nutrition table would pull the average down
+        complete = [i for i, number in enumerate(macros.day_numbers) if number not in macros.partial_days]
+        self.counted_days += len(complete)
+        self.totals += macros.days[complete].sum(axis=0)
+        known = {_dish_key(d) for d in self.dishes}
+        for day in meal_plan["days"]:
+            for meal in day["meals"]:
+                key = _dish_key(meal["title"])
+                if key and key not in known:
+                    known.add(key)
+                    self.dishes.append(meal["title"])
+
+    def text(self):
+        if not self.days_done:
+            return "It is the first week, so no days have been written yet."
+        lines = [f"Days 1 to {self.days_done} are already written."]
+        if self.counted_days:
+            kcal, protein, carbs, fat = self.totals / self.counted_days
+            lines.append(
+                f"They average {kcal:.0f} kcal, {protein:.0f} g protein, {carbs:.0f} g carbs and {fat:.0f} g fat per day "
+                "over the days with every ingredient counted "
+                f"(running total {self.totals[0]:.0f} kcal, {self.totals[1]:.0f} g protein); keep the new days in line with the targets."
+            )
+        if self.dishes:
+            lines.append("Do not repeat these recent dishes: " + "; ".join(self.dishes) + ".")
+        return "\n".join(lines)
+
+
+def window_task(task, week, first, last, total_days):
+    return WINDOW_TASK.format(
+        task=task, week=week, total_days=total_days, length=last - first + 1, first=first, last=last,
+    )
+
+
+def earlier_weeks_messages(state):
+    # The summary of earlier weeks as a message of its own. It is kept out of
+    # `task` so nutrition.parse_targets never reads its averages as the
+    # user's targets.
+    return [HumanMessage(content=state["earlier_weeks"])] if state.get("earlier_weeks") else []
+
+
+def stream_long_plan(graph, task, total_days, thread_id, max_revisions=2, **configurable):
+    # Runs the weekly graph once per window, each under its own thread, and
+    # yields every week as soon as it is done. Only the running summary is
+    # kept between windows, so each window costs the same time and memory
+    # however long the plan is. Windows that already finished are read back
+    # from their checkpoints, so calling this again resumes an interrupted plan.
+    summary = HorizonSummary()
+    spans = windows(total_days)
+    for week, (first, last) in enumerate(spans, 1):
+        window_id = window_thread_id(thread_id, week)
+        values, finished = load_plan(graph, window_id)
+        if not finished:
+            inputs = None if values else {
+                "task": window_task(task, week, first, last, total_days),
+                "earlier_weeks": summary.text(),
+                "max_revisions": max_revisions,
+                "revision_number": 1,
+                "plan_days": last - first + 1,
+            }
+            with observed_run(window_id):
+                for _ in graph.stream(inputs, thread_config(window_id, **configurable)):
+                    pass
+            values, _ = load_plan(graph, window_id)
+        summary.add_window(values.get("meal_plan"), last - first + 1)
+        yield {
+            "week": week,
+            "weeks": len(spans),
+            "first_day": first,
+            "last_day": last,
+            "draft": shift_days(values.get("draft") or "", first - 1),
+            "meal_plan": shift_plan(values.get("meal_plan"), first - 1),
+        }
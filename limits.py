@@ -0,0 +1,161 @@
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from langgraph.types import RetryPolicy
+
+from metrics import metrics
+
+# Requests per minute, burst and concurrent calls allowed per backend for the
+# whole process. Override with e.g. GEMINI_RPM, GEMINI_BURST, GEMINI_MAX_CONCURRENT.
+BACKEND_LIMITS = {
+    "gemini": {"rpm": 60, "burst": 5, "max_concurrent": 4},
+    "tavily": {"rpm": 100, "burst": 10, "max_concurrent": 4},
+}
+MAX_ATTEMPTS = 4
+BACKOFF_BASE = 1.0  # seconds
+BACKOFF_MAX = 30.0
+
+TRANSIENT_STATUS = {408, 429, 500, 502, 503, 504}
+# Raised by the Google and Tavily clients for overload and timeouts
+TRANSIENT_ERRORS = {
+    "ResourceExhausted", "ServiceUnavailable", "DeadlineExceeded", "InternalServerError",
+    "TooManyRequests", "RateLimitError", "ConnectionError", "ConnectTimeout", "ReadTimeout", "Timeout",
+}
+
+
+def is_transient(error):
+    # True for failures worth retrying: rate limits, overload and timeouts.
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    if any(cls.__name__ in TRANSIENT_ERRORS for cls in type(error).__mro__):
+        return True
+    status = getattr(error, "status_code", None) or getattr(error, "code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    try:
+        return int(status) in TRANSIENT_STATUS
+    except (TypeError, ValueError):
+        return False
+
+
+def backoff(attempt, base=BACKOFF_BASE, cap=BACKOFF_MAX):
+    # "Full jitter": anywhere up to the exponential delay, so sessions that
+    # were throttled together don't all come back at the same moment.
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate  # tokens per second
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class BackendLimiter:
+    # One per backend per process: every session's calls queue here for a
+    # concurrency slot and a rate token, and transient failures are retried
+    # with jittered exponential backoff instead of failing the run.
+
+    def __init__(self, backend, rpm, burst, max_concurrent, max_attempts=MAX_ATTEMPTS):
+        self.backend = backend
+        self.bucket = TokenBucket(rpm / 60.0, burst)
+        self.max_attempts = max_attempts
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+        self._lock = threading.Lock()
+        self.waiting = 0
+        self.in_flight = 0
+
+    @classmethod
+    def from_env(cls, backend):
+        limits = dict(BACKEND_LIMITS.get(backend, {"rpm": 60, "burst": 5, "max_concurrent": 4}))
+        for name in limits:
+            value = os.environ.get(f"{backend.upper()}_{name.upper()}")
+            if value:
+                limits[name] = float(value) if name == "rpm" else int(value)
+        return cls(backend, **limits)
+
+    def _count(self, waiting=0, in_flight=0):
+        with self._lock:
+            self.waiting += waiting
+            self.in_flight += in_flight
+            metrics.set("backend_queue_depth", self.waiting, backend=self.backend)
+            metrics.set("backend_in_flight", self.in_flight, backend=self.backend)
+
+    @contextmanager
+    def slot(self):
+        started = time.perf_counter()
+        self._count(waiting=1)
+        try:
+            self._slots.acquire()
+            try:
+                self.bucket.acquire()
+            except BaseException:
+                self._slots.release()
+                raise
+        finally:
+            self._count(waiting=-1)
+        metrics.observe("backend_wait_seconds", time.perf_counter() - started, backend=self.backend)
+        self._count(in_flight=1)
+        try:
+            yield
+        finally:
+            self._count(in_flight=-1)
+            self._slots.release()
+
+    def call(self, fn, *args, **kwargs):
+        for attempt in range(self.max_attempts):
+            try:
+                with self.slot():
+                    return fn(*args, **kwargs)
+            except Exception as error:
+                if attempt + 1 >= self.max_attempts or not is_transient(error):
+                    raise
+                metrics.inc("backend_retries_total", backend=self.backend, error=type(error).__name__)
+                time.sleep(backoff(attempt))
+
+
+class LimitedModel:
+    def __init__(self, model, limiter):
+        self.model = model
+        self.limiter = limiter
+
+    def invoke(self, messages, config=None, **kwargs):
+        return self.limiter.call(self.model.invoke, messages, config, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+
+class LimitedSearch:
+    def __init__(self, client, limiter):
+        self.client = client
+        self.limiter = limiter
+
+    def search(self, query, max_results=2, **kwargs):
+        return self.limiter.call(self.client.search, query=query, max_results=max_results, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+
+# For nodes that call a backend. A node only returns its update, so running it
+# again after a failure is safe; this covers failures that outlast the
+# per-call retries above.
+NODE_RETRY = RetryPolicy(max_attempts=2, initial_interval=5.0, jitter=True, retry_on=is_transient)
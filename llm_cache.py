@@ -0,0 +1,144 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from langchain_core.messages import AIMessage
+
+from metrics import current_node, metrics
+
+LLM_CACHE_PATH = "llm_cache.db"
+LLM_CACHE_MEMORY_ENTRIES = 256
+LLM_CACHE_DISK_ENTRIES = 10000
+LLM_CACHE_TTL = 30 * 24 * 60 * 60  # seconds
+EVICTION_POLICIES = ("lru", "fifo")
+
+
+def cache_key(model_name, temperature, messages):
+    payload = json.dumps(
+        [model_name, temperature, [(m.type, m.content) for m in messages]],
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    # Two tiers: a small in-memory dict in front of an optional SQLite file.
+    # Pass path=None to keep everything in memory.
+
+    def __init__(self, path=LLM_CACHE_PATH, memory_entries=LLM_CACHE_MEMORY_ENTRIES,
+                 disk_entries=LLM_CACHE_DISK_ENTRIES, ttl=LLM_CACHE_TTL, policy="lru"):
+        if policy not in EVICTION_POLICIES:
+            raise ValueError(f"Unknown eviction policy: {policy}")
+        self.memory_entries = memory_entries
+        self.disk_entries = disk_entries
+        self.ttl = ttl
+        self.policy = policy
+        self.hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = None
+        if path:
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache ("
+                "key TEXT PRIMARY KEY, content TEXT NOT NULL, "
+                "created_at REAL NOT NULL, last_used REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS llm_cache_last_used ON llm_cache (last_used)")
+            self._conn.commit()
+
+    def get(self, key):
+        with self._lock:
+            if key in self._memory:
+                if self.policy == "lru":
+                    self._memory.move_to_end(key)
+                self.hits += 1
+                return self._memory[key]
+            if self._conn is not None:
+                now = time.time()
+                row = self._conn.execute(
+                    "SELECT content FROM llm_cache WHERE key = ? AND created_at > ?",
+                    (key, now - self.ttl),
+                ).fetchone()
+                if row:
+                    self._conn.execute("UPDATE llm_cache SET last_used = ? WHERE key = ?", (now, key))
+                    self._conn.commit()
+                    self._remember(key, row[0])
+                    self.hits += 1
+                    return row[0]
+            self.misses += 1
+            return None
+
+    def set(self, key, content):
+        with self._lock:
+            self._remember(key, content)
+            if self._conn is not None:
+                now = time.time()
+                self._conn.execute("INSERT OR REPLACE INTO llm_cache VALUES (?, ?, ?, ?)", (key, content, now, now))
+                self._conn.execute("DELETE FROM llm_cache WHERE created_at < ?", (now - self.ttl,))
+                self._conn.execute(
+                    "DELETE FROM llm_cache WHERE key NOT IN "
+                    "(SELECT key FROM llm_cache ORDER BY last_used DESC LIMIT ?)",
+                    (self.disk_entries,),
+                )
+                self._conn.commit()
+
+    def _remember(self, key, content):
+        self._memory[key] = content
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "memory_size": len(self._memory)}
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            if self._conn is not None:
+                self._conn.execute("DELETE FROM llm_cache")
+                self._conn.commit()
+
+
+class CachedModel:
+    # Drop-in for a chat model's invoke(). Only the graph nodes listed in
+    # `nodes` use the cache (None means every node); a run started with
+    # {"configurable": {"llm_cache": False}} always asks the model again.
+
+    def __init__(self, model, cache, nodes=None, model_name=None, temperature=None):
+        self.model = model
+        self.cache = cache
+        self.nodes = set(nodes) if nodes is not None else None
+        # Given explicitly when `model` is a wrapper, whose .model is the
+        # wrapped object rather than the model's name
+        self.model_name = model_name or getattr(model, "model", None)
+        self.temperature = temperature if temperature is not None else getattr(model, "temperature", None)
+
+    def invoke(self, messages, config=None, **kwargs):
+        if not self._use_cache(config):
+            return self.model.invoke(messages, config, **kwargs)
+        key = cache_key(self.model_name, self.temperature, messages)
+        content = self.cache.get(key)
+        if content is not None:
+            metrics.inc("llm_cache_hits_total", node=current_node(config))
+            return AIMessage(content=content)
+        metrics.inc("llm_cache_misses_total", node=current_node(config))
+        response = self.model.invoke(messages, config, **kwargs)
+        self.cache.set(key, response.content)
+        return response
+
+    def _use_cache(self, config):
+        config = config or {}
+        if not config.get("configurable", {}).get("llm_cache", True):
+            return False
+        if self.nodes is None:
+            return True
+        return current_node(config) in self.nodes
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
@@ -0,0 +1,304 @@
+import cProfile
+import json
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+# Bucket upper bounds, Prometheus style (+Inf is implied)
+SECONDS_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+TOKEN_BUCKETS = (100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000)
+SIZE_BUCKETS = (0, 5, 10, 20, 40, 80, 160)
+MEMORY_BUCKETS = tuple(2 ** n for n in range(24, 31))
+
+PROFILE_DIR = "profiles"
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "count", "sum")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+
+class Metrics:
+    # Process-wide counters, gauges and histograms keyed by name and labels. Every
+    # session and batch worker in the process records into the same one, so
+    # an export shows the load as a whole.
+
+    def __init__(self):
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted((k, str(v)) for k, v in labels.items() if v is not None))
+
+    def inc(self, name, value=1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self._gauges[key] = value
+
+    def observe(self, name, value, buckets=SECONDS_BUCKETS, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._histograms.clear()
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "counters": [
+                    {"name": name, "labels": dict(labels), "value": value}
+                    for (name, labels), value in sorted(self._counters.items())
+                ],
+                "gauges": [
+                    {"name": name, "labels": dict(labels), "value": value}
+                    for (name, labels), value in sorted(self._gauges.items())
+                ],
+                "histograms": [
+                    {
+                        "name": name,
+                        "labels": dict(labels),
+                        "count": h.count,
+                        "sum": h.sum,
+                        "buckets": dict(zip(map(str, h.buckets), h.counts)),
+                    }
+                    for (name, labels), h in sorted(self._histograms.items())
+                ],
+            }
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), indent=2)
+
+    def to_prometheus(self):
+        def labels_text(labels):
+            if not labels:
+                return ""
+            return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels) + "}"
+
+        lines, typed = [], set()
+        with self._lock:
+            for kind, values in (("counter", self._counters), ("gauge", self._gauges)):
+                for (name, labels), value in sorted(values.items()):
+                    if name not in typed:
+                        typed.add(name)
+                        lines.append(f"# TYPE {name} {kind}")
+                    lines.append(f"{name}{labels_text(labels)} {value}")
+            for (name, labels), h in sorted(self._histograms.items()):
+                if name not in typed:
+                    typed.add(name)
+                    lines.append(f"# TYPE {name} histogram")
+                for bound, count in zip(h.buckets, h.counts):
+                    lines.append(f"{name}_bucket{labels_text(labels + (('le', str(bound)),))} {count}")
+                lines.append(f"{name}_bucket{labels_text(labels + (('le', '+Inf'),))} {h.count}")
+                lines.append(f"{name}_sum{labels_text(labels)} {h.sum}")
+                lines.append(f"{name}_count{labels_text(labels)} {h.count}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+def current_node(config):
+    return (config or {}).get("metadata", {}).get("langgraph_node")
+
+
+class InstrumentedModel:
+    # Times every model call and counts its tokens, labelled with the graph
+    # node that made it.
+
+    def __init__(self, model, backend):
+        self.model = model
+        self.backend = backend
+
+    def invoke(self, messages, config=None, **kwargs):
+        node = current_node(config)
+        started = time.perf_counter()
+        try:
+            response = self.model.invoke(messages, config, **kwargs)
+        except Exception:
+            metrics.inc("llm_errors_total", backend=self.backend, node=node)
+            raise
+        metrics.observe("llm_call_seconds", time.perf_counter() - started, backend=self.backend, node=node)
+        metrics.inc("llm_calls_total", backend=self.backend, node=node)
+        usage = getattr(response, "usage_metadata", None) or {}
+        for kind in ("input", "output"):
+            tokens = usage.get(f"{kind}_tokens", 0)
+            metrics.inc(f"llm_{kind}_tokens_total", tokens, backend=self.backend, node=node)
+            metrics.observe(f"llm_{kind}_tokens", tokens, TOKEN_BUCKETS, backend=self.backend, node=node)
+        return response
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+
+class InstrumentedSearch:
+    def __init__(self, client, backend):
+        self.client = client
+        self.backend = backend
+
+    def search(self, query, max_results=2, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = self.client.search(query=query, max_results=max_results, **kwargs)
+        except Exception:
+            metrics.inc("search_errors_total", backend=self.backend)
+            raise
+        metrics.observe("search_call_seconds", time.perf_counter() - started, backend=self.backend)
+        metrics.inc("search_calls_total", backend=self.backend)
+        metrics.observe("search_results", len(response.get("results", [])), SIZE_BUCKETS, backend=self.backend)
+        return response
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+
+class NodeMetrics(BaseCallbackHandler):
+    # Wall time of every graph node and the size of the research list it was
+    # given. A node's own run is the chain named after its langgraph_node;
+    # runs nested inside it are skipped.
+
+    def __init__(self):
+        self._started = {}
+        self._lock = threading.Lock()
+
+    def on_chain_start(self, serialized, inputs, *, run_id, metadata=None, **kwargs):
+        node = (metadata or {}).get("langgraph_node")
+        if node is None or kwargs.get("name") != node:
+            return
+        with self._lock:
+            self._started[run_id] = (node, time.perf_counter())
+        if isinstance(inputs, dict) and isinstance(inputs.get("content"), list):
+            metrics.observe("node_content_snippets", len(inputs["content"]), SIZE_BUCKETS, node=node)
+
+    def _finish(self, run_id, status):
+        with self._lock:
+            started = self._started.pop(run_id, None)
+        if started is not None:
+            node, at = started
+            metrics.observe("node_seconds", time.perf_counter() - at, node=node)
+            metrics.inc("node_runs_total", node=node, status=status)
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._finish(run_id, "ok")
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self._finish(run_id, "error")
+
+
+node_metrics = NodeMetrics()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.rstrip("/") in ("", "/metrics"):
+            body, content_type = metrics.to_prometheus(), "text/plain; version=0.0.4"
+        elif self.path == "/metrics.json":
+            body, content_type = metrics.to_json(), "application/json"
+        else:
+            self.send_error(404)
+            return
+        data = body.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def serve_metrics(port=None):
+    # Serves /metrics (Prometheus text) and /metrics.json from a background
+    # thread on `port` or $METRICS_PORT. Does nothing without a port;
+    # Streamlit reruns call it again, so only the first call starts the server.
+    global _server
+    port = port or os.environ.get("METRICS_PORT")
+    if not port:
+        return None
+    with _server_lock:
+        if _server is None:
+            _server = ThreadingHTTPServer(("0.0.0.0", int(port)), _MetricsHandler)
+            threading.Thread(target=_server.serve_forever, daemon=True).start()
+        return _server
+
+
+@contextmanager
+def _profiled(run_id, mode, directory):
+    if mode == "cprofile":
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            os.makedirs(directory, exist_ok=True)
+            profiler.dump_stats(os.path.join(directory, f"{run_id}.prof"))
+    elif mode == "tracemalloc" and not tracemalloc.is_tracing():
+        tracemalloc.start()
+        try:
+            yield
+        finally:
+            metrics.observe("run_peak_memory_bytes", tracemalloc.get_traced_memory()[1], MEMORY_BUCKETS)
+            tracemalloc.stop()
+    else:
+        yield
+
+
+@contextmanager
+def observed_run(run_id, profile=None, directory=PROFILE_DIR):
+    # Times one whole graph run, optionally under the profiler named by
+    # `profile` or $PROFILE_RUNS. "cprofile"
+    # writes <directory>/<run_id>.prof (open it with pstats or snakeviz); it
+    # only sees the calling thread, so nodes LangGraph runs in parallel worker
+    # threads are missing from it. "tracemalloc" records the run's peak
+    # Python memory as a metric.
+    profile = profile or os.environ.get("PROFILE_RUNS")
+    started = time.perf_counter()
+    status = "error"
+    try:
+        with _profiled(run_id, profile, directory):
+            yield
+        status = "ok"
+    finally:
+        metrics.observe("run_seconds", time.perf_counter() - started, status=status)
+        metrics.inc("runs_total", status=status)
@@ -0,0 +1,204 @@
+import csv
+import os
+import re
+import threading
+from dataclasses import dataclass, field
+from typing import List, Tuple
+
+import numpy as np
+
+from structured import MealPlan, keyword_index, name_words
+
+NUTRITION_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "nutrition.csv")
+MACROS = ("kcal", "protein", "carbs", "fat")
+TARGET_TOLERANCE = 0.1
+
+# Grams per unit; volumes assume roughly the density of water
+UNIT_GRAMS = {
+    "g": 1.0, "kg": 1000.0, "mg": 0.001, "oz": 28.35, "lb": 453.6, "lbs": 453.6,
+    "ml": 1.0, "l": 1000.0, "cup": 240.0, "cups": 240.0, "tbsp": 15.0, "tsp": 5.0,
+    "scoop": 30.0, "scoops": 30.0, "can": 150.0, "cans": 150.0,
+}
+DEFAULT_PIECE_GRAMS = 100.0
+# Words for a cut or portion of a food rather than another food
+_PORTION_WORDS = {"fillet", "filet", "slice", "piece", "chunk", "cube", "strip", "wedge", "half", "portion", "serving"}
+
+_CALORIE_TARGET = re.compile(r"(\d{3,5})\s*(?:kcal|calories|cal)\b", re.IGNORECASE)
+_PROTEIN_TARGET = re.compile(r"(\d{2,3})\s*g(?:rams)?\s*(?:of\s+)?protein\b", re.IGNORECASE)
+
+
+def normalize_food(name):
+    return " ".join(re.sub(r"[^a-z\s]", " ", name.lower()).split())
+
+
+class NutritionTable:
+    # Per-100 g macros for every food in one (foods x MACROS) float array, so a
+    # whole plan is priced with a single gather and two scatter-adds.
+
+    def __init__(self, names, values, piece_grams):
+        self.names = names
+        self.values = values
+        self.piece_grams = piece_grams
+        self.index = {name: i for i, name in enumerate(names)}
+        self._single, self._compound = keyword_index(self.index)
+        self._lookups = {}
+
+    @classmethod
+    def load(cls, path=NUTRITION_PATH):
+        names, values, piece_grams = [], [], []
+        with open(path, newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                names.append(normalize_food(row["food"]))
+                values.append([float(row[m]) for m in MACROS])
+                piece_grams.append(float(row["grams_per_piece"] or DEFAULT_PIECE_GRAMS))
+        return cls(names, np.asarray(values, dtype=np.float64), np.asarray(piece_grams, dtype=np.float64))
+
+    def lookup(self, name):
+        # Index of the food an ingredient name refers to, or -1 if unknown.
+        key = normalize_food(name)
+        if key not in self._lookups:
+            index = self.index.get(key, -1)
+            if index < 0:
+                index = self._match(name_words(key))
+            self._lookups[key] = index
+        return self._lookups[key]
+
+    def _match(self, words):
+        # The food named by the head noun, i.e. the last word that is not a cut
+        # or portion ("salmon fillet" is salmon), with food names of several
+        # words tried first, longest first ("chicken breast"). When another
+        # word is a food too the name is a different dish ("banana bread",
+        # "chickpea pasta"), and an unknown head noun ("rice cakes") is
+        # another food; both are left unmatched rather than priced wrongly.
+        words = [w for w in words if w not in _PORTION_WORDS]
+        for food, index in self._compound:
+            if tuple(words[-len(food):]) == food:
+                head, rest = index, words[:-len(food)]
+                break
+        else:
+            if not words or words[-1] not in self._single:
+                return -1
+            head, rest = self._single[words[-1]], words[:-1]
+        if any(w in self._single for w in rest):
+            return -1
+        return head
+
+    def grams(self, ingredient, index):
+        quantity = ingredient.quantity if ingredient.quantity is not None else 1.0
+        if ingredient.unit in UNIT_GRAMS:
+            return quantity * UNIT_GRAMS[ingredient.unit]
+        return quantity * self.piece_grams[index]
+
+
+_default_table = None
+_default_table_lock = threading.Lock()
+
+
+def default_table():
+    global _default_table
+    with _default_table_lock:
+        if _default_table is None:
+            _default_table = NutritionTable.load()
+        return _default_table
+
+
+@dataclass(slots=True)
+class PlanMacros:
+    # Rows follow MACROS: kcal, protein, carbs, fat
+    meals: np.ndarray
+    days: np.ndarray
+    total: np.ndarray
+    day_numbers: List[int] = field(default_factory=list)
+    meal_labels: List[Tuple[int, str]] = field(default_factory=list)
+    unmatched: List[str] = field(default_factory=list)
+    # Day numbers with an ingredient missing from the table, whose totals
+    # are therefore too low
+    partial_days: List[int] = field(default_factory=list)
+
+
+def plan_macros(plan, table=None):
+    table = table or default_table()
+    if isinstance(plan, dict):
+        plan = MealPlan.from_dict(plan)
+    meal_day, meal_labels, unmatched, partial_days = [], [], [], []
+    food_index, grams, ingredient_meal = [], [], []
+    for d, day in enumerate(plan.days):
+        for meal in day.meals:
+            meal_id = len(meal_day)
+            meal_day.append(d)
+            meal_labels.append((day.number, meal.slot))
+            for ingredient in meal.ingredients:
+                index = table.lookup(ingredient.name)
+                if index < 0:
+                    unmatched.append(ingredient.name)
+                    if day.number not in partial_days:
+                        partial_days.append(day.number)
+                    continue
+                food_index.append(index)
+                grams.append(table.grams(ingredient, index))
+                ingredient_meal.append(meal_id)
+
+    per_ingredient = table.values[np.asarray(food_index, dtype=np.intp)] * (np.asarray(grams) / 100.0)[:, None]
+    meals = np.zeros((len(meal_day), len(MACROS)))
+    np.add.at(meals, np.asarray(ingredient_meal, dtype=np.intp), per_ingredient)
+    days = np.zeros((len(plan.days), len(MACROS)))
+    np.add.at(days, np.asarray(meal_day, dtype=np.intp), meals)
+    return PlanMacros(
+        meals=meals,
+        days=days,
+        total=days.sum(axis=0),
+        day_numbers=[day.number for day in plan.days],
+        meal_labels=meal_labels,
+        unmatched=unmatched,
+        partial_days=partial_days,
+    )
+
+
+def parse_targets(task):
+    # Daily calorie and protein targets stated in the user's request, if any.
+    calories = _CALORIE_TARGET.search(task or "")
+    protein = _PROTEIN_TARGET.search(task or "")
+    return (
+        float(calories.group(1)) if calories else None,
+        float(protein.group(1)) if protein else None,
+    )
+
+
+def check_targets(macros, calories=None, protein=None, tolerance=TARGET_TOLERANCE):
+    problems = []
+    for column, target, unit in ((0, calories, "kcal"), (1, protein, "g protein")):
+        if target is None:
+            continue
+        off = macros.days[:, column] - target
+        for day_number, delta in zip(macros.day_numbers, off):
+            # A partial day can only be known to be over: its uncounted
+            # ingredients would raise it
+            if delta < 0 and day_number in macros.partial_days:
+                continue
+            if abs(delta) > tolerance * target:
+                direction = "over" if delta > 0 else "under"
+                problems.append(f"Day {day_number} is {abs(delta):.0f} {unit} {direction} the daily target of {target:.0f} {unit}")
+    return problems
+
+
+def nutrition_report(meal_plan, task, table=None):
+    # Facts for the critic, computed from the plan's ingredients rather than
+    # asked of the model. None when the draft had no parseable plan.
+    if not meal_plan:
+        return None
+    macros = plan_macros(meal_plan, table)
+    lines = ["Nutrition computed from the listed ingredients:"]
+    for day_number, (kcal, protein, carbs, fat) in zip(macros.day_numbers, macros.days):
+        partial = " (partial, some ingredients not counted)" if day_number in macros.partial_days else ""
+        lines.append(f"- Day {day_number}: {kcal:.0f} kcal, {protein:.0f} g protein, {carbs:.0f} g carbs, {fat:.0f} g fat{partial}")
+    kcal, protein, carbs, fat = macros.total
+    at_least = "at least " if macros.partial_days else ""
+    lines.append(f"- Total: {at_least}{kcal:.0f} kcal, {protein:.0f} g protein, {carbs:.0f} g carbs, {fat:.0f} g fat")
+    problems = check_targets(macros, *parse_targets(task))
+    if problems:
+        lines.append("Targets missed:")
+        lines.extend(f"- {p}" for p in problems)
+    if macros.unmatched:
+        lines.append("Not in the nutrition table (not counted, so partial days are lower than the real intake "
+                     "and are not checked for falling short of the targets): " + ", ".join(sorted(set(macros.unmatched))))
+    return "\n".join(lines)
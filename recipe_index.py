@@ -0,0 +1,380 @@
+import hashlib
+import json
+import math
+import mmap
+import os
+import shutil
+import threading
+import time
+from collections import Counter
+
+import numpy as np
+
+from corpus import tokenize
+from metrics import SIZE_BUCKETS, metrics
+from research import search_responses
+
+RECIPE_CORPUS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "recipes")
+RECIPE_INDEX_PATH = os.environ.get("RECIPE_INDEX", "recipe_index")
+BM25_K1 = 1.5
+BM25_B = 0.75
+# Local hits scoring below both of these count as no answer, and the query
+# goes to web search instead
+MIN_LOCAL_SCORE = 2.0
+MIN_LOCAL_SIMILARITY = 0.6
+# Reciprocal rank fusion constant for combining BM25 and vector rankings
+RRF_K = 60
+EMBED_BATCH = 100
+INDEX_CHECK_INTERVAL = 5.0  # seconds between checks for a rebuilt index
+
+
+def read_corpus(path=RECIPE_CORPUS_PATH):
+    # Documents under `path`: one per line of a .jsonl file ({"content": ...,
+    # and optionally "id", "title", "url"}) and one per .md or .txt file.
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for name in sorted(files):
+            file_path = os.path.join(root, name)
+            rel = os.path.relpath(file_path, path)
+            if name.endswith(".jsonl"):
+                with open(file_path, encoding="utf-8") as f:
+                    for line_number, line in enumerate(f, 1):
+                        if not line.strip():
+                            continue
+                        row = json.loads(line)
+                        yield {
+                            "id": str(row.get("id", f"{rel}:{line_number}")),
+                            "title": row.get("title", ""),
+                            "url": row.get("url", ""),
+                            "content": row["content"],
+                        }
+            elif name.endswith((".md", ".txt")):
+                with open(file_path, encoding="utf-8") as f:
+                    content = f.read()
+                yield {"id": rel, "title": content.strip().split("\n", 1)[0].lstrip("# "), "url": "", "content": content}
+
+
+def fingerprint(doc):
+    return hashlib.sha1(f"{doc['title']}\n{doc['content']}".encode("utf-8")).hexdigest()
+
+
+def _previous(path):
+    # id -> (fingerprint, term counts, row) from the index already at `path`,
+    # so an update only tokenizes and embeds documents that changed.
+    if not os.path.exists(os.path.join(path, "meta.json")):
+        return {}, None
+    previous = {}
+    with open(os.path.join(path, "docs.jsonl"), encoding="utf-8") as docs, \
+            open(os.path.join(path, "terms.jsonl"), encoding="utf-8") as terms:
+        for row, (doc_line, terms_line) in enumerate(zip(docs, terms)):
+            doc = json.loads(doc_line)
+            previous[doc["id"]] = (doc["fingerprint"], json.loads(terms_line), row)
+    vectors_path = os.path.join(path, "vectors.npy")
+    vectors = np.load(vectors_path, mmap_mode="r") if os.path.exists(vectors_path) else None
+    return previous, vectors
+
+
+def _embed_all(embed, texts):
+    vectors = []
+    for start in range(0, len(texts), EMBED_BATCH):
+        vectors.extend(embed(texts[start:start + EMBED_BATCH]))
+    vectors = np.asarray(vectors, dtype=np.float32)
+    # Stored unit length, so a dot product is the cosine similarity
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+
+def build_index(docs, path=RECIPE_INDEX_PATH, embed=None, k1=BM25_K1, b=BM25_B):
+    # Writes the BM25 postings, and with `embed` (a function from a list of
+    # texts to a list of vectors) a dense vector per document, to the
+    # directory `path`. Documents already indexed with the same content keep
+    # their term counts and vectors; only new and changed ones are tokenized
+    # and embedded. The new index is written beside the old one and swapped
+    # in, so processes searching the old files are not disturbed.
+    previous, old_vectors = _previous(path)
+    docs = list({doc["id"]: doc for doc in docs}.values())
+    all_terms, reused, changed = [], [], []
+    for i, doc in enumerate(docs):
+        doc["fingerprint"] = fingerprint(doc)
+        old = previous.get(doc["id"])
+        if old and old[0] == doc["fingerprint"]:
+            all_terms.append(old[1])
+            reused.append((i, old[2]))
+        else:
+            all_terms.append(dict(Counter(tokenize(f"{doc['title']}\n{doc['content']}"))))
+            changed.append(i)
+
+    # One row per (document, term), then sorted by term into postings lists
+    keys, counts = [], []
+    for terms in all_terms:
+        keys.extend(terms)
+        counts.extend(terms.values())
+    vocab_terms = sorted(set().union(*all_terms))
+    term_ids = {term: i for i, term in enumerate(vocab_terms)}
+    rows_term = np.fromiter(map(term_ids.__getitem__, keys), dtype=np.int32, count=len(keys))
+    rows_doc = np.repeat(np.arange(len(all_terms), dtype=np.int32), [len(t) for t in all_terms])
+    rows_tf = np.asarray(counts, dtype=np.float32)
+    # Stable, so each term's documents stay in document order
+    order = np.argsort(rows_term, kind="stable")
+    rows_term, rows_doc, rows_tf = rows_term[order], rows_doc[order], rows_tf[order]
+    lengths = np.asarray([sum(t.values()) for t in all_terms], dtype=np.float32)
+    avg_len = float(lengths.mean()) if len(lengths) else 1.0
+    # Everything in BM25 but the idf depends only on the document, so it is
+    # computed here once instead of on every query
+    weights = rows_tf * (k1 + 1) / (rows_tf + k1 * (1 - b + b * lengths[rows_doc] / (avg_len or 1.0)))
+    df = np.bincount(rows_term, minlength=len(vocab_terms))
+    starts = np.cumsum(df) - df
+    vocab = {term: [int(start), int(count)] for term, start, count in zip(vocab_terms, starts.tolist(), df.tolist())}
+
+    tmp = path.rstrip(os.sep) + ".tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    np.save(os.path.join(tmp, "postings_docs.npy"), rows_doc)
+    np.save(os.path.join(tmp, "postings_weights.npy"), weights.astype(np.float32))
+    offsets = [0]
+    with open(os.path.join(tmp, "docs.jsonl"), "wb") as f_docs, \
+            open(os.path.join(tmp, "terms.jsonl"), "w", encoding="utf-8") as f_terms:
+        for doc, terms in zip(docs, all_terms):
+            f_docs.write(json.dumps(doc).encode("utf-8") + b"\n")
+            offsets.append(f_docs.tell())
+            f_terms.write(json.dumps(terms) + "\n")
+    np.save(os.path.join(tmp, "offsets.npy"), np.asarray(offsets, dtype=np.int64))
+    with open(os.path.join(tmp, "vocab.json"), "w", encoding="utf-8") as f:
+        json.dump(vocab, f)
+
+    dim = None
+    if embed is not None and docs:
+        can_reuse = old_vectors is not None
+        todo = changed if can_reuse else list(range(len(docs)))
+        fresh = _embed_all(embed, [f"{docs[i]['title']}\n{docs[i]['content']}" for i in todo]) if todo else None
+        if can_reuse and fresh is not None and fresh.shape[1] != old_vectors.shape[1]:
+            # A different embedding model: none of the old vectors fit
+            can_reuse, todo = False, list(range(len(docs)))
+            fresh = _embed_all(embed, [f"{d['title']}\n{d['content']}" for d in docs])
+        dim = fresh.shape[1] if fresh is not None else old_vectors.shape[1]
+        vectors = np.lib.format.open_memmap(os.path.join(tmp, "vectors.npy"), mode="w+", dtype=np.float32, shape=(len(docs), dim))
+        if can_reuse:
+            for i, row in reused:
+                vectors[i] = old_vectors[row]
+        if fresh is not None:
+            vectors[todo] = fresh
+        vectors.flush()
+        del vectors
+
+    meta = {"documents": len(docs), "k1": k1, "b": b, "dim": dim}
+    with open(os.path.join(tmp, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    old = path.rstrip(os.sep) + ".old"
+    shutil.rmtree(old, ignore_errors=True)
+    if os.path.exists(path):
+        os.replace(path, old)
+    os.replace(tmp, path)
+    shutil.rmtree(old, ignore_errors=True)
+    return {
+        "documents": len(docs),
+        "indexed": len(changed),
+        "unchanged": len(reused),
+        "removed": len(set(previous) - {doc["id"] for doc in docs}),
+        "terms": len(vocab),
+    }
+
+
+class RecipeIndex:
+    # Read-only view of an index written by build_index. Postings, document
+    # offsets and vectors are memory-mapped, so opening a large corpus is
+    # instant, pages are shared between processes, and only the parts a
+    # query touches are read. Answers in the shape of TavilyClient.search, so
+    # it can stand in for web search.
+
+    def __init__(self, path=RECIPE_INDEX_PATH, embed=None):
+        self.path = path
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+            self.meta = json.load(f)
+        with open(os.path.join(path, "vocab.json"), encoding="utf-8") as f:
+            self.vocab = json.load(f)
+        self.documents = self.meta["documents"]
+        self.postings_docs = np.load(os.path.join(path, "postings_docs.npy"), mmap_mode="r")
+        self.postings_weights = np.load(os.path.join(path, "postings_weights.npy"), mmap_mode="r")
+        self.offsets = np.load(os.path.join(path, "offsets.npy"), mmap_mode="r")
+        vectors_path = os.path.join(path, "vectors.npy")
+        self.vectors = np.load(vectors_path, mmap_mode="r") if os.path.exists(vectors_path) else None
+        # Query embeddings are only usable against document vectors
+        self.embed = embed if self.vectors is not None else None
+        # Mapped like the arrays: slicing keeps no file position, so concurrent
+        # searches need no lock (an empty file cannot be mapped)
+        with open(os.path.join(path, "docs.jsonl"), "rb") as f:
+            self._docs = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if self.documents else b""
+
+    def __del__(self):
+        # A replaced index is dropped once no search holds it any more
+        if isinstance(getattr(self, "_docs", None), mmap.mmap):
+            self._docs.close()
+
+    @classmethod
+    def load(cls, path=RECIPE_INDEX_PATH, embed=None):
+        # None when no index has been built at `path`
+        if not os.path.exists(os.path.join(path, "meta.json")):
+            return None
+        return cls(path, embed)
+
+    def doc(self, i):
+        start, end = int(self.offsets[i]), int(self.offsets[i + 1])
+        return json.loads(self._docs[start:end])
+
+    def bm25(self, query):
+        scores = np.zeros(self.documents, dtype=np.float32)
+        for term in set(tokenize(query)):
+            entry = self.vocab.get(term)
+            if entry is None:
+                continue
+            start, df = entry
+            idf = math.log(1 + (self.documents - df + 0.5) / (df + 0.5))
+            # Each document appears once per term, so fancy-index += is safe
+            scores[self.postings_docs[start:start + df]] += idf * self.postings_weights[start:start + df]
+        return scores
+
+    def top_k(self, queries, k=5):
+        # [(doc, score)] best first for every query. With vectors and an
+        # embedding function the BM25 and cosine rankings are fused (RRF);
+        # all queries are embedded in one call and scored in one matrix product.
+        if not self.documents or not queries:
+            return [[] for _ in queries]
+        lexical = np.stack([self.bm25(q) for q in queries])
+        similarity = None
+        if self.embed is not None:
+            query_vectors = np.asarray(self.embed(list(queries)), dtype=np.float32)
+            query_vectors /= np.maximum(np.linalg.norm(query_vectors, axis=1, keepdims=True), 1e-12)
+            similarity = query_vectors @ self.vectors.T
+        results = []
+        for q in range(len(queries)):
+            relevant = lexical[q] >= MIN_LOCAL_SCORE
+            if similarity is None:
+                scores = np.where(relevant, lexical[q], -np.inf)
+            else:
+                relevant |= similarity[q] >= MIN_LOCAL_SIMILARITY
+                scores = np.where(relevant, _rrf(lexical[q]) + _rrf(similarity[q]), -np.inf)
+            count = min(k, int(relevant.sum()))
+            if not count:
+                results.append([])
+                continue
+            best = np.argpartition(-scores, count - 1)[:count]
+            best = best[np.argsort(-scores[best])]
+            results.append([(int(i), float(scores[i])) for i in best])
+        return results
+
+    def search_many(self, queries, max_results=5):
+        return [self._response(q, hits) for q, hits in zip(queries, self.top_k(queries, max_results))]
+
+    def search(self, query, max_results=5, **kwargs):
+        return self.search_many([query], max_results)[0]
+
+    def _response(self, query, hits):
+        results = []
+        for i, score in hits:
+            doc = self.doc(i)
+            results.append({
+                "title": doc["title"],
+                "url": doc["url"] or f"local:{doc['id']}",
+                "content": doc["content"],
+                "score": score,
+            })
+        return {"query": query, "results": results}
+
+
+def _rrf(scores):
+    ranks = np.empty(len(scores), dtype=np.float32)
+    ranks[np.argsort(-scores)] = np.arange(1, len(scores) + 1)
+    return 1.0 / (RRF_K + ranks)
+
+
+def _index_version(path):
+    # Changes whenever build_index swaps in a new index, None when there is none
+    try:
+        stat = os.stat(os.path.join(path, "meta.json"))
+    except OSError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns
+
+
+class FallbackSearch:
+    # The local index first; web search only for queries it has nothing
+    # relevant for. The index is reopened when build_index replaces it, at
+    # most INDEX_CHECK_INTERVAL seconds later, so re-indexing needs no restart.
+
+    def __init__(self, web, path=RECIPE_INDEX_PATH, embed=None):
+        self.web = web
+        self.path = path
+        self.embed = embed
+        self._lock = threading.Lock()
+        self._index = None
+        self._version = None
+        self._checked = None
+
+    def index(self):
+        with self._lock:
+            now = time.monotonic()
+            if self._checked is None or now - self._checked >= INDEX_CHECK_INTERVAL:
+                self._checked = now
+                version = _index_version(self.path)
+                if version != self._version:
+                    self._index = RecipeIndex.load(self.path, self.embed)
+                    self._version = version
+            return self._index
+
+    def search_many(self, queries, max_results=2):
+        index = self.index()
+        responses = [None] * len(queries)
+        if index is not None:
+            started = time.perf_counter()
+            try:
+                responses = index.search_many(queries, max_results)
+            except Exception:
+                # e.g. the query embedding hit a quota or network error; the
+                # web can still answer every query
+                metrics.inc("search_errors_total", backend="local")
+            else:
+                metrics.observe("search_call_seconds", time.perf_counter() - started, backend="local")
+                metrics.inc("search_calls_total", len(queries), backend="local")
+                for response in responses:
+                    metrics.observe("search_results", len(response["results"]), SIZE_BUCKETS, backend="local")
+        misses = [i for i, response in enumerate(responses) if not (response and response["results"])]
+        if misses:
+            metrics.inc("search_fallbacks_total", len(misses))
+            for i, response in zip(misses, search_responses(self.web, [queries[i] for i in misses], max_results)):
+                responses[i] = response or {"query": queries[i], "results": []}
+        return responses
+
+    def search(self, query, max_results=2, **kwargs):
+        return self.search_many([query], max_results)[0]
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Build or query the local recipe index.")
+    parser.add_argument("--index", default=RECIPE_INDEX_PATH, help=f"index directory (default: {RECIPE_INDEX_PATH})")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="index a corpus; unchanged documents are reused")
+    build.add_argument("corpus", nargs="?", default=RECIPE_CORPUS_PATH)
+    build.add_argument("--embedding-model", help="also store dense vectors, e.g. models/text-embedding-004")
+    search = commands.add_parser("search", help="print the best matches for queries")
+    search.add_argument("queries", nargs="+")
+    search.add_argument("-k", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        embed = None
+        if args.embedding_model:
+            from dotenv import load_dotenv
+            from langchain_google_genai import GoogleGenerativeAIEmbeddings
+
+            load_dotenv()
+            embed = GoogleGenerativeAIEmbeddings(model=args.embedding_model).embed_documents
+        print(json.dumps(build_index(read_corpus(args.corpus), args.index, embed), indent=2))
+    else:
+        index = RecipeIndex.load(args.index)
+        if index is None:
+            raise SystemExit(f"No index at {args.index}; run the build command first")
+        for response in index.search_many(args.queries, args.k):
+            print(f"{response['query']}:")
+            for result in response["results"]:
+                print(f"  {result['score']:.2f}  {result['title'] or result['url']}")
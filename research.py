@@ -0,0 +1,39 @@
+import math
+from concurrent.futures import ThreadPoolExecutor, wait
+
+SEARCH_MAX_WORKERS = 3
+SEARCH_TIMEOUT = 15  # seconds allowed for a single query
+
+
+def search_responses(client, queries, max_results=2, max_workers=SEARCH_MAX_WORKERS, timeout=SEARCH_TIMEOUT):
+    # Send all queries at once instead of one after another. Responses keep
+    # the order of the queries; a query that fails or times out gets None.
+    if not queries:
+        return []
+    workers = max(1, min(max_workers, len(queries)))
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        futures = [executor.submit(client.search, query=q, max_results=max_results) for q in queries]
+        # With fewer workers than queries the later ones queue up, so allow one
+        # timeout per wave of queries.
+        done, _ = wait(futures, timeout=timeout * math.ceil(len(queries) / workers))
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+    return [
+        future.result() if future in done and future.exception() is None else None
+        for future in futures
+    ]
+
+
+def search_queries(client, queries, max_results=2, max_workers=SEARCH_MAX_WORKERS, timeout=SEARCH_TIMEOUT):
+    # Snippets for all queries, skipping any that failed so the research
+    # step still returns whatever the other queries found. Clients with a
+    # search_many method (the local recipe index) get the whole list at once.
+    if not queries:
+        return []
+    search_many = getattr(client, "search_many", None)
+    if search_many is not None:
+        responses = search_many(queries, max_results=max_results)
+    else:
+        responses = search_responses(client, queries, max_results, max_workers, timeout)
+    return [r['content'] for response in responses if response for r in response['results']]
@@ -0,0 +1,252 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import nullcontext
+from dataclasses import dataclass
+from datetime import datetime
+
+from metrics import metrics
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# 100 ns intervals between the UUID epoch (1582-10-15) and the Unix epoch
+_UUID_EPOCH_OFFSET = 0x01B21DD213814000
+_BLOB_REF = re.compile(rb"[0-9a-f]{64}")
+
+
+@dataclass(slots=True)
+class RetentionPolicy:
+    max_checkpoints_per_thread: int = 10
+    thread_ttl: float = 72 * 60 * 60  # seconds since a thread's last checkpoint
+    # Blobs younger than this are kept even when unreferenced, since a running
+    # node may have stored them before its checkpoint is written
+    blob_grace: float = 60 * 60
+    vacuum_min_free_pages: int = 1024
+    interval: float = 10 * 60  # seconds between background passes; 0 disables them
+
+    @classmethod
+    def from_env(cls):
+        policy = cls()
+        for name, env, cast in (
+            ("max_checkpoints_per_thread", "CHECKPOINT_MAX_PER_THREAD", int),
+            ("thread_ttl", "CHECKPOINT_TTL_SECONDS", float),
+            ("interval", "CHECKPOINT_GC_INTERVAL", float),
+        ):
+            if os.environ.get(env):
+                setattr(policy, name, cast(os.environ[env]))
+        return policy
+
+
+def checkpoint_time(checkpoint_id):
+    # Checkpoint ids are time-based: version 6 UUIDs in current LangGraph,
+    # ISO timestamps in older releases. None if neither.
+    try:
+        value = uuid.UUID(checkpoint_id)
+        if value.version == 6:
+            n = value.int
+            ticks = (n >> 96) << 28 | ((n >> 80) & 0xFFFF) << 12 | (n >> 64) & 0x0FFF
+            return (ticks - _UUID_EPOCH_OFFSET) / 1e7
+    except ValueError:
+        pass
+    try:
+        return datetime.fromisoformat(checkpoint_id).timestamp()
+    except ValueError:
+        return None
+
+
+def _columns(conn, table):
+    return {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+
+
+def prune_checkpoints(conn, policy, now=None):
+    # Drops checkpoints beyond the newest `max_checkpoints_per_thread` of each
+    # thread, whole threads idle for longer than `thread_ttl`, and the pending
+    # writes of every checkpoint removed. Returns (checkpoints, threads) removed.
+    columns = _columns(conn, "checkpoints")
+    if not columns:
+        return 0, 0
+    id_column = "checkpoint_id" if "checkpoint_id" in columns else "thread_ts"
+    partition = "thread_id, checkpoint_ns" if "checkpoint_ns" in columns else "thread_id"
+    now = now or time.time()
+
+    expired = [
+        thread_id
+        for thread_id, last_id in conn.execute(f"SELECT thread_id, MAX({id_column}) FROM checkpoints GROUP BY thread_id")
+        if (checkpoint_time(last_id) or now) < now - policy.thread_ttl
+    ]
+    removed = 0
+    for thread_id in expired:
+        removed += conn.execute("DELETE FROM checkpoints WHERE thread_id = ?", (thread_id,)).rowcount
+    removed += conn.execute(
+        f"DELETE FROM checkpoints WHERE rowid IN (SELECT rowid FROM ("
+        f"SELECT rowid, ROW_NUMBER() OVER (PARTITION BY {partition} ORDER BY {id_column} DESC) AS newest "
+        f"FROM checkpoints) WHERE newest > ?)",
+        (policy.max_checkpoints_per_thread,),
+    ).rowcount
+    if _columns(conn, "writes"):
+        conn.execute(
+            f"DELETE FROM writes WHERE NOT EXISTS (SELECT 1 FROM checkpoints c "
+            f"WHERE c.thread_id = writes.thread_id AND c.{id_column} = writes.{id_column})"
+        )
+    return removed, len(expired)
+
+
+def referenced_blobs(conn):
+    # Every blob hash still mentioned in a checkpoint or a pending write.
+    referenced = set()
+    for table, column in (("checkpoints", "checkpoint"), ("writes", "value")):
+        if column not in _columns(conn, table):
+            continue
+        for (data,) in conn.execute(f"SELECT {column} FROM {table}"):
+            if isinstance(data, str):
+                data = data.encode("utf-8")
+            referenced.update(ref.decode("ascii") for ref in _BLOB_REF.findall(data or b""))
+    return referenced
+
+
+def sweep_blobs(conn, policy, referenced=None, now=None):
+    # Mark and sweep: blobs in `referenced` (by default every hash still
+    # mentioned in the database) are kept, other blobs past the grace period
+    # are deleted. The delete checks the age again, so a blob stored again
+    # after `referenced` was read gets its fresh created_at and survives.
+    if not _columns(conn, "blobs"):
+        return 0
+    now = now or time.time()
+    cutoff = now - policy.blob_grace
+    if referenced is None:
+        referenced = referenced_blobs(conn)
+    stale = [
+        ref for (ref,) in conn.execute("SELECT ref FROM blobs WHERE created_at < ?", (cutoff,))
+        if ref not in referenced
+    ]
+    removed = 0
+    for start in range(0, len(stale), 500):
+        chunk = stale[start:start + 500]
+        removed += conn.execute(
+            f"DELETE FROM blobs WHERE created_at < ? AND ref IN ({','.join('?' * len(chunk))})", [cutoff, *chunk]
+        ).rowcount
+    return removed
+
+
+def compact(conn, policy):
+    # Hands freed pages back to the file system once enough have piled up.
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    free_pages = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    if free_pages < policy.vacuum_min_free_pages:
+        return False
+    try:
+        conn.execute("VACUUM")
+    except sqlite3.OperationalError:
+        # Another connection is mid-transaction; try again next pass
+        return False
+    return True
+
+
+def memory_report(conn=None):
+    # Process and checkpoint-store footprint, also published as gauges.
+    report = {}
+    try:
+        report["process_max_rss_bytes"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    except AttributeError:  # no resource module
+        pass
+    try:
+        with open("/proc/self/statm") as f:
+            report["process_rss_bytes"] = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        pass
+    if conn is not None:
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        report["checkpoint_db_bytes"] = conn.execute("PRAGMA page_count").fetchone()[0] * page_size
+        if _columns(conn, "checkpoints"):
+            report["checkpoint_threads"] = conn.execute("SELECT COUNT(DISTINCT thread_id) FROM checkpoints").fetchone()[0]
+            report["checkpoint_count"] = conn.execute("SELECT COUNT(*) FROM checkpoints").fetchone()[0]
+        if _columns(conn, "blobs"):
+            report["blob_count"] = conn.execute("SELECT COUNT(*) FROM blobs").fetchone()[0]
+    for name, value in report.items():
+        metrics.set(name, value)
+    return report
+
+
+def _reader(conn):
+    # A second connection to the same database file, so long reads and the
+    # compaction do not hold the saver's connection. None for in-memory databases.
+    path = next((file for _, name, file in conn.execute("PRAGMA database_list") if name == "main"), "")
+    if not path:
+        return None
+    reader = sqlite3.connect(path, timeout=30)
+    reader.execute("PRAGMA busy_timeout = 30000")
+    return reader
+
+
+def collect(saver, policy=None):
+    # One retention pass over a SqliteSaver's database. Only the deletes run
+    # under the saver's own lock; the scan for referenced blobs and the
+    # compaction use a separate connection, so live sessions keep writing
+    # checkpoints meanwhile.
+    policy = policy or RetentionPolicy.from_env()
+    started = time.perf_counter()
+    lock = getattr(saver, "lock", None) or nullcontext()
+    conn = saver.conn
+    with lock:
+        checkpoints, threads = prune_checkpoints(conn, policy)
+        conn.commit()
+    reader = _reader(conn)
+    try:
+        if reader is None:
+            with lock:
+                blobs = sweep_blobs(conn, policy)
+                conn.commit()
+                vacuumed = compact(conn, policy)
+                report = memory_report(conn)
+        else:
+            now = time.time()
+            referenced = referenced_blobs(reader)
+            reader.commit()
+            with lock:
+                blobs = sweep_blobs(conn, policy, referenced, now)
+                conn.commit()
+            vacuumed = compact(reader, policy)
+            report = memory_report(reader)
+    finally:
+        if reader is not None:
+            reader.close()
+    metrics.inc("retention_checkpoints_removed_total", checkpoints)
+    metrics.inc("retention_threads_expired_total", threads)
+    metrics.inc("retention_blobs_removed_total", blobs)
+    metrics.observe("retention_pass_seconds", time.perf_counter() - started)
+    return {"checkpoints_removed": checkpoints, "threads_expired": threads, "blobs_removed": blobs,
+            "vacuumed": vacuumed, **report}
+
+
+def start_retention(saver, policy=None):
+    # Runs collect() every `policy.interval` seconds on a daemon thread.
+    policy = policy or RetentionPolicy.from_env()
+    if not policy.interval:
+        return None
+
+    def loop():
+        while True:
+            time.sleep(policy.interval)
+            try:
+                collect(saver, policy)
+            except sqlite3.Error:
+                metrics.inc("retention_errors_total")
+
+    thread = threading.Thread(target=loop, name="checkpoint-retention", daemon=True)
+    thread.start()
+    return thread
+
+
+if __name__ == "__main__":
+    import json
+
+    from checkpoint import get_checkpointer
+
+    # One pass right now, e.g. from cron when the background thread is disabled
+    print(json.dumps(collect(get_checkpointer()), indent=2))
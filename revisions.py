@@ -0,0 +1,125 @@
+import re
+
+from langchain_core.messages import HumanMessage, SystemMessage
+
+from structured import PLAN_FORMAT
+
+REVISION_PROMPT = """You are an excellent meal planner revising parts of an existing meal plan.
+Rewrite only the sections below so that they address the critique. Keep each section's heading line exactly as given,
+keep the same format as the original, and do not write any other sections.
+Use the information below as needed:
+------
+{content}"""
+
+# Parts of a plan other than days that a critique can single out
+NAMED_SECTIONS = {
+    "snacks": r"snacks?",
+    "shopping list": r"shopping\s+list|grocer(?:y|ies)",
+    "nutrition": r"macros?|nutrition(?:al)?\s+(?:summary|info\w*|breakdown)|calorie\s+(?:summary|breakdown)",
+}
+
+# Rebuilt from the meal ingredients after every draft, never rewritten by the model
+REBUILT_SECTIONS = {"shopping list"}
+
+_DAY_HEADING = re.compile(r"^\W*day\s+(\d+)\b", re.IGNORECASE)
+# "Day 3", "Days 3 and 5", "Days 2-4", "days 1, 3 and 6 to 7"
+_DAY_SPAN = r"\d+(?:\s*(?:-|–|to|through)\s*\d+)?"
+_DAY_MENTION = re.compile(
+    rf"\bdays?\s+({_DAY_SPAN}(?:\s*(?:,\s*and|,|and|&|or)\s*{_DAY_SPAN})*)\b", re.IGNORECASE
+)
+# A named heading is the name alone on its line, give or take a couple of words
+# ("Weekly Shopping List:"), so "Snacks: apple" inside a day is not one
+_NAMED_HEADINGS = {
+    name: re.compile(rf"(?:[\w-]+\s+){{0,2}}(?:{pattern})(?:\s+[\w-]+){{0,2}}", re.IGNORECASE)
+    for name, pattern in NAMED_SECTIONS.items()
+}
+
+
+def section_key(line):
+    match = _DAY_HEADING.match(line)
+    if match:
+        return f"day {int(match.group(1))}"
+    title = line.strip().strip("#*_ ").rstrip(":*_ ")
+    for name, heading in _NAMED_HEADINGS.items():
+        if heading.fullmatch(title):
+            return name
+    return None
+
+
+def split_sections(draft):
+    # Ordered (key, text) pairs; text before the first heading is keyed "intro".
+    sections = [["intro", []]]
+    for line in (draft or "").splitlines():
+        key = section_key(line)
+        if key and key not in (k for k, _ in sections):
+            sections.append([key, []])
+        sections[-1][1].append(line)
+    return [(key, "\n".join(lines)) for key, lines in sections if lines or key != "intro"]
+
+
+def mentioned_days(critique):
+    days = set()
+    for match in _DAY_MENTION.finditer(critique or ""):
+        for span in re.findall(_DAY_SPAN, match.group(1)):
+            bounds = [int(n) for n in re.findall(r"\d+", span)]
+            days.update(range(bounds[0], bounds[-1] + 1))
+    return days
+
+
+def flagged_sections(critique, keys):
+    # Sections of the draft the critique names, or None when it names none of
+    # them (or all of them) and the plan should be rewritten as a whole.
+    critique = critique or ""
+    keys = [key for key in keys if key != "intro" and key not in REBUILT_SECTIONS]
+    days = mentioned_days(critique)
+    flagged = []
+    for key in keys:
+        if key.startswith("day "):
+            if int(key.split()[1]) in days:
+                flagged.append(key)
+        elif key in NAMED_SECTIONS and re.search(NAMED_SECTIONS[key], critique, re.IGNORECASE):
+            flagged.append(key)
+    if not flagged or len(flagged) == len(keys):
+        return None
+    return flagged
+
+
+def splice(draft_sections, revised_sections):
+    revised = dict(revised_sections)
+    parts = []
+    for key, text in draft_sections:
+        if key in revised:
+            # Keep the blank lines that separated the old section from the next one
+            text = revised[key] + text[len(text.rstrip()):]
+        parts.append(text)
+    return "\n".join(parts)
+
+
+def revise_flagged_sections(model, state, content, config=None):
+    # Regenerates only the sections the critique points at and splices them
+    # into the previous draft. Returns (response, draft), or (None, None) when
+    # there is no previous draft, the critique calls for a full rewrite, or the
+    # reply does not bring back every flagged section under its heading.
+    draft, critique = state.get("draft"), state.get("critique")
+    if not draft or not critique:
+        return None, None
+    sections = split_sections(draft)
+    flagged = flagged_sections(critique, [key for key, _ in sections])
+    if flagged is None:
+        return None, None
+
+    original = "\n\n".join(text for key, text in sections if key in flagged)
+    messages = [
+        SystemMessage(content=REVISION_PROMPT.format(content=content) + PLAN_FORMAT),
+        HumanMessage(content=f"{state['task']}\n\nCritique:\n{critique}\n\nSections to revise:\n\n{original}"),
+    ]
+    # Not streamed: the UIs would show the revised sections alone in place of
+    # the whole draft. The spliced draft arrives with the node's update.
+    config = {**(config or {}), "tags": [*(config or {}).get("tags", []), "nostream"]}
+    response = model.invoke(messages, config)
+    revised = [(key, text.rstrip()) for key, text in split_sections(response.content) if key in flagged]
+    if {key for key, _ in revised} != set(flagged):
+        # Splicing would leave some flagged sections as they were, and the
+        # unchanged draft would look converged
+        return None, None
+    return response, splice(sections, revised)
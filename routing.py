@@ -0,0 +1,50 @@
+from dataclasses import dataclass
+from typing import Optional
+
+from factory import chat_model
+from metrics import current_node
+
+WRITER_MODEL = "gemini-1.5-pro"
+FAST_MODEL = "gemini-1.5-flash"
+
+
+@dataclass(frozen=True, slots=True)
+class ModelRoute:
+    model_name: str
+    temperature: float
+    max_output_tokens: Optional[int] = None
+
+
+# Steps with short, structured output don't need the large model: three
+# search queries, or a critique ending in a severity line.
+FAST_ROUTES = {
+    "research_meal_plan": ModelRoute(FAST_MODEL, 0.2, 256),
+    "research_critique": ModelRoute(FAST_MODEL, 0.2, 256),
+    "reflect_plan": ModelRoute(FAST_MODEL, 0.3, 1024),
+}
+
+
+class ModelRouter:
+    # Drop-in for a chat model's invoke() that sends each call to the model
+    # configured for the graph node making it; nodes missing from `routes`
+    # use `default`. Each route's model is built once and shared.
+
+    def __init__(self, default, routes=None, cache_nodes=None):
+        self.default = default
+        self.routes = dict(routes or {})
+        self.cache_nodes = cache_nodes
+        self._models = {}
+
+    def route(self, node):
+        return self.routes.get(node, self.default)
+
+    def for_node(self, node):
+        route = self.route(node)
+        if route not in self._models:
+            self._models[route] = chat_model(
+                route.model_name, route.temperature, self.cache_nodes, route.max_output_tokens
+            )
+        return self._models[route]
+
+    def invoke(self, messages, config=None, **kwargs):
+        return self.for_node(current_node(config)).invoke(messages, config, **kwargs)
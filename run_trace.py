@@ -0,0 +1,24 @@
+import time
+
+
+class RunTrace:
+    # Collects what each node produced during one graph run. A run opts in by
+    # putting a RunTrace in its config: {"configurable": {"trace": RunTrace()}};
+    # without one, record() is a dict lookup and nothing else.
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.events = []
+
+    def record(self, label, content):
+        self.events.append({
+            "label": label,
+            "content": content,
+            "elapsed": time.perf_counter() - self.started,
+        })
+
+
+def record(config, label, content):
+    trace = (config or {}).get("configurable", {}).get("trace")
+    if trace is not None:
+        trace.record(label, content)
@@ -1,30 +1,58 @@
-import os
+import operator
 import re
-from langgraph.checkpoint.sqlite import SqliteSaver
-from langgraph.graph import StateGraph, END
+import time
+from langgraph.graph import StateGraph, START, END
 from langchain_core.messages import SystemMessage, HumanMessage
+from langchain_core.runnables import RunnableConfig
 from langchain_core.pydantic_v1 import BaseModel
-from tavily import TavilyClient
-from typing import TypedDict, List
-from langchain_google_genai import ChatGoogleGenerativeAI
+from typing import Annotated, TypedDict, List, Optional
 from dotenv import load_dotenv
+from factory import compiled_graph, search_client
+from routing import FAST_ROUTES, WRITER_MODEL, ModelRoute, ModelRouter
+from research import search_queries
+from corpus import select_content
+from blobs import load_texts, merge_content_refs, store_texts
+from streaming import live_draft, stream_plan
+from run_trace import record
+from structured import PLAN_FORMAT, QUERY_FORMAT, extract_json, try_parse_plan
+from nutrition import nutrition_report
+from shopping_list import SHOPPING_LIST_NOTE, parse_people, with_shopping_list
+from revisions import revise_flagged_sections
+from convergence import SEVERITY_INSTRUCTIONS, ConvergencePolicy, parse_severity, response_tokens
+from checkpoint import get_checkpointer, new_thread_id, thread_config
+from metrics import observed_run, serve_metrics
+from limits import NODE_RETRY
 import gradio as gr
 import json
 
 load_dotenv()
-
-memory = SqliteSaver.from_conn_string(":memory:")
+# Exposes /metrics when METRICS_PORT is set
+serve_metrics()
 
 class AgentState(TypedDict):
     task: str
     plan: str
     draft: str
     critique: str
-    content: List[str]
+    # Hashes of research snippets in the blob store; both research nodes can
+    # write in the same step and merge_content_refs combines their snippets
+    content: Annotated[List[str], merge_content_refs]
     revision_number: int
     max_revisions: int
+    critique_severity: Optional[int]
+    tokens_used: Annotated[int, operator.add]
+    started_at: float
+    stop_reason: Optional[str]
+    meal_plan: Optional[dict]
+
+# Graph nodes whose model responses are reused for identical prompts
+LLM_CACHE_NODES = {"meal_planner", "research_meal_plan", "generate", "reflect_plan", "research_critique"}
 
-model = ChatGoogleGenerativeAI(model="gemini-1.5-pro", temperature=0.4)
+# The plan and the drafts come from the large model; queries and critique from a faster one
+model = ModelRouter(ModelRoute(WRITER_MODEL, 0.4), FAST_ROUTES, cache_nodes=LLM_CACHE_NODES)
+
+# Stops the revision loop early once the draft settles or the critique has nothing important left
+convergence = ConvergencePolicy()
 
 PLAN_PROMPT = """You are an expert meal planner tasked with writing a meal plan. \
 Write a meal plan for the user provided topic. Give an outline of the meal plan along with any relevant notes, \
@@ -33,7 +61,7 @@ recipes based on user preferences, shopping list based on ingredients, available
 WRITER_PROMPT = """You are a meal planner assistant tasked with writing excellent meal plans. \
 Generate the best meal plan possible for the user's request and the initial outline. \
 Follow this outline: Day 1: -Breakfast, -Lunch, -Dinner with the specific time. \
-Do include the shopping list for the meal plan. \
+Do include the ingredients for every meal. \
 If the user provides critique, respond with a revised version of your previous attempts. \
 Use all the information below as needed: 
 ------ 
@@ -55,103 +83,139 @@ Generate a list of search queries that will gather any relevant information. Onl
 class Queries(BaseModel):
     queries: List[str]
 
-tavily = TavilyClient(api_key=os.environ["TAVILY_API_KEY"])
+tavily = search_client()
 
-def plan_node(state: AgentState):
+def plan_node(state: AgentState, config: RunnableConfig):
     messages = [
         SystemMessage(content=PLAN_PROMPT),
         HumanMessage(content=state['task'])
     ]
-    response = model.invoke(messages)
-    return {"plan": response.content}
+    response = model.invoke(messages, config)
+    return {
+        "plan": response.content,
+        "started_at": state.get("started_at") or time.time(),
+        "tokens_used": response_tokens(response)
+    }
 
 def parse_queries(response_content):
-    # Extract queries from the response content using regex
-    pattern = r'\*\*"(.*?)"\*\*'
-    queries = re.findall(pattern, response_content)
-    return queries
-
-def research_meal_plan_node(state: AgentState):
+    # The research prompts ask for JSON matching Queries; older **"query"** replies still parse
+    try:
+        return Queries.parse_raw(extract_json(response_content)).queries
+    except ValueError:
+        pattern = r'\*\*"(.*?)"\*\*'
+        return re.findall(pattern, response_content)
+
+def research_meal_plan_node(state: AgentState, config: RunnableConfig):
     messages = [
-        SystemMessage(content=RESEARCH_PLAN_PROMPT),
+        SystemMessage(content=RESEARCH_PLAN_PROMPT + QUERY_FORMAT),
         HumanMessage(content=state['task'])
     ]
-    response = model.invoke(messages)
-    print("Meal Plan Response:", response.content)  # Debug print
+    response = model.invoke(messages, config)
+    record(config, "Meal Plan Response", response.content)
     queries = parse_queries(response.content)
-    content = state['content'] or []
-    for q in queries:
-        search_response = tavily.search(query=q, max_results=2)
-        for r in search_response['results']:
-            content.append(r['content'])
-    return {"content": content}
-
-def generation_node(state: AgentState):
-    content = "\n\n".join(state['content'] or [])
-    user_message = HumanMessage(
-        content=f"{state['task']}\n\nHere is my meal plan:\n\n{state['plan']}")
-    messages = [
-        SystemMessage(
-            content=WRITER_PROMPT.format(content=content)
-        ),
-        user_message
-    ]
-    response = model.invoke(messages)
+    content = store_texts(search_queries(tavily, queries))
+    return {"content": content, "tokens_used": response_tokens(response)}
+
+def generation_node(state: AgentState, config: RunnableConfig):
+    content = "\n\n".join(select_content(load_texts(state['content']), state['task'], state.get('critique')))
+    # When the critique names specific days or sections, rewrite only those
+    response, draft = revise_flagged_sections(model, state, content, config)
+    if response is None:
+        user_message = HumanMessage(
+            content=f"{state['task']}\n\nHere is my meal plan:\n\n{state['plan']}")
+        messages = [
+            SystemMessage(
+                content=WRITER_PROMPT.format(content=content) + PLAN_FORMAT + SHOPPING_LIST_NOTE
+            ),
+            user_message
+        ]
+        response = model.invoke(messages, config)
+        draft = response.content
+    tokens_used = state.get("tokens_used", 0) + response_tokens(response)
+    parsed = try_parse_plan(draft)
+    meal_plan = parsed.to_dict() if parsed else None
+    # The shopping list is computed from the ingredients instead of written by the model
+    draft = with_shopping_list(draft, meal_plan, parse_people(state['task']))
     return {
-        "draft": response.content,
-        "revision_number": state.get("revision_number", 1) + 1
+        "draft": draft,
+        "meal_plan": meal_plan,
+        "revision_number": state.get("revision_number", 1) + 1,
+        "tokens_used": response_tokens(response),
+        "stop_reason": convergence.after_draft(state, draft, tokens_used)
     }
 
-def reflection_node(state: AgentState):
+def reflection_node(state: AgentState, config: RunnableConfig):
     messages = [
-        SystemMessage(content=REFLECTION_PROMPT),
+        SystemMessage(content=REFLECTION_PROMPT + SEVERITY_INSTRUCTIONS),
         HumanMessage(content=state['draft'])
     ]
-    response = model.invoke(messages)
-    return {"critique": response.content}
+    # Give the critic computed calories and protein instead of having it estimate them
+    report = nutrition_report(state.get('meal_plan'), state['task'])
+    if report:
+        messages.append(HumanMessage(content=report))
+    response = model.invoke(messages, config)
+    severity = parse_severity(response.content)
+    tokens_used = state.get("tokens_used", 0) + response_tokens(response)
+    return {
+        "critique": response.content,
+        "critique_severity": severity,
+        "tokens_used": response_tokens(response),
+        "stop_reason": convergence.after_critique(state, severity, tokens_used)
+    }
 
-def research_critique_node(state: AgentState):
+def research_critique_node(state: AgentState, config: RunnableConfig):
     messages = [
-        SystemMessage(content=RESEARCH_CRITIQUE_PROMPT),
+        SystemMessage(content=RESEARCH_CRITIQUE_PROMPT + QUERY_FORMAT),
         HumanMessage(content=state['critique'])
     ]
-    response = model.invoke(messages)
-    print("Research Critique Response:", response.content)  # Debug print
+    response = model.invoke(messages, config)
+    record(config, "Research Critique Response", response.content)
     queries = parse_queries(response.content)
-    content = state['content'] or []
-    for q in queries:
-        search_response = tavily.search(query=q, max_results=2)
-        for r in search_response['results']:
-            content.append(r['content'])
-    return {"content": content}
+    content = store_texts(search_queries(tavily, queries))
+    return {"content": content, "tokens_used": response_tokens(response)}
 
 def should_continue(state):
-    if state["revision_number"] > state["max_revisions"]:
+    if state.get("stop_reason") or state["revision_number"] > state["max_revisions"]:
         return END
     return "reflect_plan"
 
-builder = StateGraph(AgentState)
+def should_revise(state):
+    if state.get("stop_reason"):
+        return END
+    return "research_critique"
 
-builder.add_node("meal_planner", plan_node)
-builder.add_node("generate", generation_node)
-builder.add_node("reflect_plan", reflection_node)
-builder.add_node("research_meal_plan", research_meal_plan_node)
-builder.add_node("research_critique", research_critique_node)
+def build_graph():
+    builder = StateGraph(AgentState)
 
-builder.set_entry_point("meal_planner")
+    # Nodes that call Gemini or Tavily run again if a call still fails after its own retries
+    builder.add_node("meal_planner", plan_node, retry=NODE_RETRY)
+    builder.add_node("generate", generation_node, retry=NODE_RETRY)
+    builder.add_node("reflect_plan", reflection_node, retry=NODE_RETRY)
+    builder.add_node("research_meal_plan", research_meal_plan_node, retry=NODE_RETRY)
+    builder.add_node("research_critique", research_critique_node, retry=NODE_RETRY)
 
-builder.add_conditional_edges(
-    "generate", 
-    should_continue, 
-    {END: END, "reflect_plan": "reflect_plan"}
-)
+    # The outline and the initial research only need the task, so they run side by side
+    builder.add_edge(START, "meal_planner")
+    builder.add_edge(START, "research_meal_plan")
+
+    builder.add_conditional_edges(
+        "generate", 
+        should_continue, 
+        {END: END, "reflect_plan": "reflect_plan"}
+    )
+
+    builder.add_edge(["meal_planner", "research_meal_plan"], "generate")
+    builder.add_conditional_edges(
+        "reflect_plan",
+        should_revise,
+        {END: END, "research_critique": "research_critique"}
+    )
+    builder.add_edge("research_critique", "generate")
 
-builder.add_edge("meal_planner", "research_meal_plan")
-builder.add_edge("research_meal_plan", "generate")
-builder.add_edge("reflect_plan", "research_critique")
-builder.add_edge("research_critique", "generate")
+    return builder.compile(checkpointer=get_checkpointer())
 
-graph = builder.compile(checkpointer=memory)
+# Compiled on first use and shared by every session in the process
+graph = compiled_graph("sample", build_graph)
 
 def meal_planner_interface(task, max_revisions):
     state = {
@@ -159,11 +223,12 @@ def meal_planner_interface(task, max_revisions):
         'max_revisions': max_revisions,
         'revision_number': 1
     }
-    thread = {"configurable": {"thread_id": "1"}}
-    outputs = []
-    for s in graph.stream(state, thread):
-        outputs.append(s)
-    return "\n\n".join([str(output['draft']) for output in outputs])
+    thread_id = new_thread_id()
+    # Gradio re-renders the output box on every yield, so users see each step and the draft as it is written
+    with observed_run(thread_id):
+        for steps, draft in live_draft(stream_plan(graph, state, thread_config(thread_id))):
+            progress = "\n".join(f"- {step}" for step in steps)
+            yield f"{progress}\n\n{draft}"
 
 interface = gr.Interface(
     fn=meal_planner_interface,
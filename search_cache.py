@@ -0,0 +1,93 @@
+import json
+import re
+import sqlite3
+import threading
+import time
+
+from metrics import metrics
+
+SEARCH_CACHE_PATH = "search_cache.db"
+SEARCH_CACHE_TTL = 7 * 24 * 60 * 60  # seconds
+SEARCH_CACHE_MAX_ENTRIES = 5000
+
+
+def normalize_query(query):
+    # "High-protein bulking breakfast, calories" and "high protein bulking
+    # breakfast calories" should share one cache entry.
+    query = re.sub(r"[^\w\s]", " ", query.lower())
+    return " ".join(query.split())
+
+
+class CachedSearchClient:
+    # Wraps anything with a Tavily-style search(query=..., max_results=...)
+    # method and keeps its responses in a local SQLite file.
+
+    def __init__(self, client, path=SEARCH_CACHE_PATH, ttl=SEARCH_CACHE_TTL, max_entries=SEARCH_CACHE_MAX_ENTRIES):
+        self.client = client
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS search_cache ("
+            "query TEXT NOT NULL, max_results INTEGER NOT NULL, response TEXT NOT NULL, "
+            "created_at REAL NOT NULL, last_used REAL NOT NULL, "
+            "PRIMARY KEY (query, max_results))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS search_cache_last_used ON search_cache (last_used)")
+        self._conn.commit()
+
+    def search(self, query, max_results=2, **kwargs):
+        key = normalize_query(query)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, created_at FROM search_cache WHERE query = ? AND max_results = ?",
+                (key, max_results),
+            ).fetchone()
+            if row and now - row[1] < self.ttl:
+                self._conn.execute(
+                    "UPDATE search_cache SET last_used = ? WHERE query = ? AND max_results = ?",
+                    (now, key, max_results),
+                )
+                self._conn.commit()
+                self.hits += 1
+                metrics.inc("search_cache_hits_total")
+                return json.loads(row[0])
+            self.misses += 1
+            metrics.inc("search_cache_misses_total")
+
+        # The network call happens outside the lock so concurrent searches
+        # from the research nodes don't wait on each other.
+        response = self.client.search(query=query, max_results=max_results, **kwargs)
+
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO search_cache VALUES (?, ?, ?, ?, ?)",
+                (key, max_results, json.dumps(response), now, now),
+            )
+            self._evict()
+            self._conn.commit()
+        return response
+
+    def _evict(self):
+        self._conn.execute("DELETE FROM search_cache WHERE created_at < ?", (time.time() - self.ttl,))
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM search_cache").fetchone()
+        if count > self.max_entries:
+            self._conn.execute(
+                "DELETE FROM search_cache WHERE rowid IN "
+                "(SELECT rowid FROM search_cache ORDER BY last_used LIMIT ?)",
+                (count - self.max_entries,),
+            )
+
+    def stats(self):
+        with self._lock:
+            (size,) = self._conn.execute("SELECT COUNT(*) FROM search_cache").fetchone()
+        return {"hits": self.hits, "misses": self.misses, "size": size}
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM search_cache")
+            self._conn.commit()
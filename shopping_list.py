@@ -0,0 +1,166 @@
+import math
+import re
+from dataclasses import dataclass
+
+from revisions import split_sections
+from structured import NUMBER_WORDS, MealPlan, keyword_index, name_words, singular
+
+SHOPPING_LIST_NOTE = """
+Do not write a shopping list; it is built from the meal ingredients automatically."""
+
+# unit -> (dimension, factor to the dimension's base unit)
+UNIT_CONVERSIONS = {
+    "g": ("mass", 1.0), "kg": ("mass", 1000.0), "mg": ("mass", 0.001),
+    "oz": ("mass", 28.35), "lb": ("mass", 453.6), "lbs": ("mass", 453.6),
+    "ml": ("volume", 1.0), "l": ("volume", 1000.0),
+    "cup": ("volume", 240.0), "cups": ("volume", 240.0),
+    "tbsp": ("volume", 15.0), "tsp": ("volume", 5.0),
+    "scoop": ("scoop", 1.0), "scoops": ("scoop", 1.0),
+    "can": ("can", 1.0), "cans": ("can", 1.0),
+    "slice": ("slice", 1.0), "slices": ("slice", 1.0),
+    "clove": ("clove", 1.0), "cloves": ("clove", 1.0),
+    "pinch": ("pinch", 1.0), "pinches": ("pinch", 1.0),
+    "piece": ("piece", 1.0), "pieces": ("piece", 1.0), "": ("piece", 1.0),
+}
+
+AISLES = {
+    "Produce": (
+        "apple", "avocado", "eggplant", "banana", "berry", "blueberry", "broccoli", "carrot", "cucumber", "garlic",
+        "kale", "lemon", "lettuce", "lime", "mushroom", "onion", "orange", "pear", "pepper", "potato",
+        "raspberry", "spinach", "strawberry", "tomato", "zucchini", "herb", "ginger",
+    ),
+    "Meat & Seafood": (
+        "bacon", "beef", "chicken", "fish", "ham", "pepperoni", "pork", "salmon", "sausage", "shrimp", "tuna", "turkey",
+    ),
+    "Dairy & Eggs": ("butter", "cheese", "cottage", "cream", "egg", "feta", "milk", "mozzarella", "yogurt"),
+    "Bakery": ("bagel", "bread", "bun", "tortilla", "wrap"),
+    "Pantry": (
+        "almond", "bean", "chia", "chickpea", "chocolate", "flour", "granola", "honey", "lentil", "oats",
+        "oil", "pasta", "peanut", "powder", "quinoa", "rice", "salt", "sauce", "seed", "spice", "sugar",
+        "vinegar", "walnut", "hummus", "tofu", "cracker", "peanut butter", "almond butter", "almond milk",
+        "oat milk", "soy milk", "coconut milk",
+    ),
+}
+OTHER_AISLE = "Other"
+MAX_PEOPLE = 20
+PLURAL_UNITS = {"pinch": "pinches"}
+
+# Words that describe how an ingredient is prepared, not what to buy
+_PREPARATION = re.compile(
+    r"\b(large|medium|small|fresh|frozen|chopped|diced|sliced|minced|cooked|grilled|baked|boiled|"
+    r"roasted|steamed|raw|ripe|lean|boneless|skinless|shredded|grated|of)\b"
+)
+
+_COUNT = "|".join([r"\d+", *sorted(NUMBER_WORDS, key=len, reverse=True)])
+# "for 4 people", "the three of us", "family of 5", "serves 2"
+_PEOPLE = re.compile(
+    rf"\b(?:(?:family|household) of|serves|feeds)\s+({_COUNT})\b|\b({_COUNT})\s+(?:people|persons|adults|of us)\b",
+    re.IGNORECASE,
+)
+
+
+@dataclass(slots=True)
+class ShoppingItem:
+    name: str
+    aisle: str
+    dimension: str
+    quantity: float = 0.0
+    # Set when some uses of the ingredient gave no amount
+    unmeasured: bool = False
+
+
+def normalize_ingredient(name):
+    name = _PREPARATION.sub(" ", re.sub(r"\(.*?\)|[^a-z\s]", " ", name.lower()))
+    return " ".join(singular(w) for w in name.split())
+
+
+_SINGLE_KEYWORDS, _COMPOUND_KEYWORDS = keyword_index(
+    {keyword: aisle for aisle, keywords in AISLES.items() for keyword in keywords}
+)
+
+
+def aisle_for(name):
+    # Whole words only ("graham" is not "ham"); compound keywords first, then
+    # the head noun, i.e. the last word ("cheese sauce" is a sauce).
+    words = name_words(name)
+    for keyword, aisle in _COMPOUND_KEYWORDS:
+        if any(tuple(words[i:i + len(keyword)]) == keyword for i in range(len(words) - len(keyword) + 1)):
+            return aisle
+    for word in reversed(words):
+        if word in _SINGLE_KEYWORDS:
+            return _SINGLE_KEYWORDS[word]
+    return OTHER_AISLE
+
+
+def parse_people(task):
+    # How many people the user is shopping for, if the request says; 1 otherwise.
+    match = _PEOPLE.search(task or "")
+    if not match:
+        return 1
+    count = (match.group(1) or match.group(2)).lower()
+    people = int(NUMBER_WORDS.get(count, count))
+    return min(people, MAX_PEOPLE) if people > 0 else 1
+
+
+def build_shopping_list(plan, people=1):
+    # Merges every ingredient of the plan by (normalized name, unit dimension)
+    # and scales the totals for `people`. Returns items sorted by aisle, name.
+    if isinstance(plan, dict):
+        plan = MealPlan.from_dict(plan)
+    items = {}
+    for day in plan.days:
+        for meal in day.meals:
+            for ingredient in meal.ingredients:
+                name = normalize_ingredient(ingredient.name)
+                if not name:
+                    continue
+                dimension, factor = UNIT_CONVERSIONS.get(ingredient.unit, ("piece", 1.0))
+                key = (name, dimension)
+                item = items.get(key)
+                if item is None:
+                    item = items[key] = ShoppingItem(name=name, aisle=aisle_for(name), dimension=dimension)
+                if ingredient.quantity is None:
+                    item.unmeasured = True
+                else:
+                    item.quantity += ingredient.quantity * factor * people
+    aisle_order = {aisle: i for i, aisle in enumerate([*AISLES, OTHER_AISLE])}
+    return sorted(items.values(), key=lambda i: (aisle_order[i.aisle], i.name))
+
+
+def format_quantity(item):
+    if not item.quantity:
+        return None
+    if item.dimension == "mass":
+        return f"{item.quantity / 1000:.3g} kg" if item.quantity >= 1000 else f"{math.ceil(item.quantity)} g"
+    if item.dimension == "volume":
+        return f"{item.quantity / 1000:.3g} l" if item.quantity >= 1000 else f"{math.ceil(item.quantity)} ml"
+    count = math.ceil(item.quantity)
+    if item.dimension == "piece":
+        return str(count)
+    unit = item.dimension if count == 1 else PLURAL_UNITS.get(item.dimension, item.dimension + "s")
+    return f"{count} {unit}"
+
+
+def render_shopping_list(items, people=1):
+    lines = ["**Shopping List:**"]
+    if people > 1:
+        lines.append(f"*Quantities for {people} people.*")
+    aisle = None
+    for item in items:
+        if item.aisle != aisle:
+            aisle = item.aisle
+            lines.append(f"\n*{aisle}*")
+        quantity = format_quantity(item)
+        if quantity and item.unmeasured:
+            quantity += " + to taste"
+        lines.append(f"- {item.name}: {quantity}" if quantity else f"- {item.name}")
+    return "\n".join(lines)
+
+
+def with_shopping_list(draft, meal_plan, people=1):
+    # Replaces whatever shopping list the draft has with one computed from the
+    # plan's ingredients. Drafts without a parsed plan are returned unchanged.
+    if not meal_plan:
+        return draft
+    sections = [text for key, text in split_sections(draft) if key != "shopping list"]
+    return "\n".join(sections).rstrip() + "\n\n" + render_shopping_list(build_shopping_list(meal_plan, people), people) + "\n"
@@ -0,0 +1,71 @@
+STREAM_TOKEN_NODES = ("generate",)
+# Nodes whose update carries a complete draft
+DRAFT_NODES = ("generate", "merge_days")
+
+NODE_LABELS = {
+    "meal_planner": "Outlined the meal plan",
+    "research_meal_plan": "Researched recipes and nutrition",
+    "outline_ready": "Outline and research are ready",
+    "generate": "Wrote a draft",
+    "generate_day": "Wrote a day of the plan",
+    "merge_days": "Put the week together",
+    "reflect_plan": "Reviewed the draft",
+    "research_critique": "Researched the requested revisions",
+}
+
+
+def stream_plan(graph, inputs, config, token_nodes=STREAM_TOKEN_NODES):
+    # Turns the graph's "updates" and "messages" streams into one sequence of
+    # events: {"type": "node", ...} when a node finishes and {"type": "token", ...}
+    # for each chunk the model emits while running one of `token_nodes`.
+    for mode, chunk in graph.stream(inputs, config, stream_mode=["updates", "messages"]):
+        if mode == "messages":
+            message, metadata = chunk
+            node = metadata.get("langgraph_node")
+            if node in token_nodes and message.content:
+                yield {"type": "token", "node": node, "text": message.content}
+            continue
+        for node, update in chunk.items():
+            yield {"type": "node", "node": node, "update": update or {}}
+
+
+def revision_streams(events, on_node=None):
+    # Splits the event stream into one token generator per draft (a pass
+    # through `generate` or `merge_days`), so a UI can redraw the draft for
+    # each revision. Each inner generator must be consumed before asking for
+    # the next one.
+    events = iter(events)
+    finished = False
+
+    def tokens():
+        nonlocal finished
+        for event in events:
+            if event["type"] == "token":
+                yield event["text"]
+                continue
+            if on_node:
+                on_node(event["node"], event["update"])
+            if event["node"] in DRAFT_NODES:
+                return
+        finished = True
+
+    while not finished:
+        yield tokens()
+
+
+def live_draft(events):
+    # Folds the event stream into (finished steps, current draft) snapshots.
+    # Tokens after any node update start a new draft, and a draft node's
+    # update always replaces whatever was streamed with the full draft.
+    steps, draft, draft_done = [], "", False
+    for event in events:
+        if event["type"] == "token":
+            if draft_done:
+                draft, draft_done = "", False
+            draft += event["text"]
+        else:
+            steps.append(NODE_LABELS.get(event["node"], event["node"]))
+            if event["node"] in DRAFT_NODES:
+                draft = event["update"].get("draft") or draft
+            draft_done = True
+        yield steps, draft
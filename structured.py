@@ -0,0 +1,216 @@
+import re
+from dataclasses import asdict, dataclass, field
+from typing import List, Optional
+
+QUERY_FORMAT = """
+Respond with JSON only, in the form {"queries": ["first query", "second query"]}."""
+
+PLAN_FORMAT = """
+Write every day as a "Day N:" line followed by one line per meal in exactly this form:
+  Breakfast - <dish> | <calories> kcal | <protein> g protein | ingredients: <amount> <unit> <ingredient>, <amount> <unit> <ingredient>
+Use Breakfast, Lunch, Dinner or Snack as the meal name."""
+
+UNITS = {
+    "g", "kg", "mg", "oz", "lb", "lbs", "ml", "l", "cup", "cups", "tbsp", "tsp",
+    "slice", "slices", "piece", "pieces", "can", "cans", "clove", "cloves", "scoop", "scoops",
+    "pinch", "pinches",
+}
+
+_DAY = re.compile(r"^\W*day\s+(\d+)\b", re.IGNORECASE)
+_MEAL = re.compile(r"^\W*(breakfast|lunch|dinner|snacks?)\b\W*?\s*[-:–]\s*(.+)$", re.IGNORECASE)
+_CALORIES = re.compile(r"(\d+(?:\.\d+)?)\s*(?:kcal|calories|cal)\b", re.IGNORECASE)
+_PROTEIN = re.compile(r"(\d+(?:\.\d+)?)\s*g\s*(?:of\s+)?protein\b", re.IGNORECASE)
+_INGREDIENTS = re.compile(r"ingredients?\s*:\s*(.+)$", re.IGNORECASE)
+_AMOUNT = re.compile(r"^(\d+(?:\.\d+)?|\d+/\d+)\s*([a-zA-Z]+\.?)?\s+(.+)$")
+NUMBER_WORDS = {
+    "one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6, "seven": 7, "eight": 8, "nine": 9,
+    "ten": 10, "eleven": 11, "twelve": 12, "thirteen": 13, "fourteen": 14, "fifteen": 15, "sixteen": 16,
+    "seventeen": 17, "eighteen": 18, "nineteen": 19, "twenty": 20,
+}
+# Words that only look plural
+_KEEP_PLURAL = {"oats", "greens", "grits", "hummus", "couscous", "asparagus", "citrus", "swiss", "molasses"}
+
+
+class PlanParseError(ValueError):
+    pass
+
+
+@dataclass(slots=True)
+class Ingredient:
+    name: str
+    quantity: Optional[float] = None
+    unit: str = ""
+
+
+@dataclass(slots=True)
+class Meal:
+    slot: str
+    title: str
+    calories: Optional[float] = None
+    protein: Optional[float] = None
+    ingredients: List[Ingredient] = field(default_factory=list)
+
+
+@dataclass(slots=True)
+class Day:
+    number: int
+    meals: List[Meal] = field(default_factory=list)
+
+
+@dataclass(slots=True)
+class MealPlan:
+    days: List[Day] = field(default_factory=list)
+
+    def to_dict(self):
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(days=[
+            Day(number=d["number"], meals=[
+                Meal(
+                    slot=m["slot"],
+                    title=m["title"],
+                    calories=m.get("calories"),
+                    protein=m.get("protein"),
+                    ingredients=[Ingredient(**i) for i in m.get("ingredients", [])],
+                )
+                for m in d["meals"]
+            ])
+            for d in data["days"]
+        ])
+
+
+def extract_json(text):
+    # Models like to wrap JSON in prose or ``` fences; take the outermost object.
+    start, end = text.find("{"), text.rfind("}")
+    if start == -1 or end < start:
+        raise ValueError("No JSON object in response")
+    return text[start:end + 1]
+
+
+def singular(word):
+    if word in _KEEP_PLURAL:
+        return word
+    if word.endswith("ies") and len(word) > 4:
+        return word[:-3] + "y"
+    if word.endswith(("oes", "ches", "shes")):
+        return word[:-2]
+    if word.endswith("s") and not word.endswith("ss") and len(word) > 3:
+        return word[:-1]
+    return word
+
+
+def name_words(name):
+    return [singular(w) for w in re.findall(r"[a-z]+", name.lower())]
+
+
+def keyword_index(keywords):
+    # Splits a {keyword: value} mapping into single words and word tuples for
+    # whole-word matching of ingredient names. The tuples come longest first,
+    # so "peanut butter" is tried before "butter".
+    single, compound = {}, []
+    for keyword, value in keywords.items():
+        words = tuple(name_words(keyword))
+        if len(words) == 1:
+            single[words[0]] = value
+        elif words:
+            compound.append((words, value))
+    compound.sort(key=lambda k: len(k[0]), reverse=True)
+    return single, compound
+
+
+def parse_quantity(amount):
+    if "/" in amount:
+        numerator, denominator = amount.split("/")
+        return float(numerator) / float(denominator)
+    return float(amount)
+
+
+def parse_ingredient(text):
+    text = text.strip().rstrip(".")
+    match = _AMOUNT.match(text)
+    if not match:
+        return Ingredient(name=text)
+    amount, unit, name = match.groups()
+    unit = (unit or "").rstrip(".").lower()
+    if unit and unit not in UNITS:
+        # "2 large eggs": the word after the number is part of the name
+        name, unit = f"{match.group(2)} {name}", ""
+    return Ingredient(name=name.strip(), quantity=parse_quantity(amount), unit=unit)
+
+
+def parse_meal(slot, rest):
+    fields = [f.strip() for f in rest.split("|")]
+    meal = Meal(slot="snack" if slot.lower().startswith("snack") else slot.lower(), title=fields[0].strip("*_ "))
+    for f in fields[1:]:
+        ingredients = _INGREDIENTS.search(f)
+        if ingredients:
+            meal.ingredients = [parse_ingredient(i) for i in ingredients.group(1).split(",") if i.strip()]
+            continue
+        calories = _CALORIES.search(f)
+        if calories and meal.calories is None:
+            meal.calories = float(calories.group(1))
+        protein = _PROTEIN.search(f)
+        if protein and meal.protein is None:
+            meal.protein = float(protein.group(1))
+    return meal
+
+
+def parse_plan(text):
+    # One pass over the draft's lines: "Day N" headings open a day and meal
+    # lines in PLAN_FORMAT fill it. Anything else (notes, shopping list) is
+    # ignored. Raises PlanParseError when no day with meals is found.
+    plan = MealPlan()
+    days = {}
+    current = None
+    for line in (text or "").splitlines():
+        day = _DAY.match(line)
+        if day:
+            number = int(day.group(1))
+            current = days.get(number)
+            if current is None:
+                current = days[number] = Day(number=number)
+                plan.days.append(current)
+            continue
+        meal = _MEAL.match(line)
+        if meal and current is not None:
+            current.meals.append(parse_meal(*meal.groups()))
+    plan.days = [d for d in plan.days if d.meals]
+    if not plan.days:
+        raise PlanParseError("No days with meals found in the plan")
+    plan.days.sort(key=lambda d: d.number)
+    return plan
+
+
+def try_parse_plan(text):
+    try:
+        return parse_plan(text)
+    except PlanParseError:
+        return None
+
+
+def format_amount(value):
+    return f"{value:g}"
+
+
+def render_markdown(plan):
+    lines = []
+    for day in plan.days:
+        lines.append(f"**Day {day.number}:**")
+        for meal in day.meals:
+            parts = [f"  {meal.slot.capitalize()} - {meal.title}"]
+            if meal.calories is not None:
+                parts.append(f"{format_amount(meal.calories)} kcal")
+            if meal.protein is not None:
+                parts.append(f"{format_amount(meal.protein)} g protein")
+            if meal.ingredients:
+                parts.append("ingredients: " + ", ".join(
+                    " ".join(p for p in (
+                        format_amount(i.quantity) if i.quantity is not None else "", i.unit, i.name
+                    ) if p)
+                    for i in meal.ingredients
+                ))
+            lines.append(" | ".join(parts))
+        lines.append("")
+    return "\n".join(lines).rstrip() + "\n"